@@ -2,6 +2,7 @@
 # Modo: SOLO ubicación manual
 # Requisitos: streamlit, googlemaps, requests, python-dotenv, pandas, numpy
 
+import uuid
 import numpy as np
 import pandas as pd
 import streamlit as st
@@ -12,23 +13,29 @@ st.set_page_config(page_title="Recomendador Emocional", layout="wide")
 # ==== imports desde módulos refactorizados ====
 from config import (
     gmaps, GEMINI_API_KEY, GOOGLE_MAPS_API_KEY,
-    LIST_CONTAINER_HEIGHT_PX, W_RATING, W_REVIEWS, W_PROX
+    LIST_CONTAINER_HEIGHT_PX, RESULTS_PAGE_SIZE, W_RATING, W_REVIEWS, W_PROX, NEARBY_TOP_K, DETAILS_PREFETCH_TOP_N,
+    PHOTO_THUMB_WIDTH
 )
 from taxonomy import _map_term_to_canon
 from brain import (
-    detect_mood_category, _fallback_empathy,
-    gemini_brain, normalize_to_nearby_keywords, mock_from_mood
+    detect_mood_category,
+    brain_answer, LLM_CACHE
 )
 from maps_io import (
-    gm_embed_directions_url, maps_directions_link,
-    get_place_details, place_photo_url
+    gm_embed_directions_url, maps_directions_link
 )
+from details import get_details, peek_details, prefetch_details, details_cache_stats
+from photos import photo_bytes, photo_cache_stats
 from ranking import (
-    geocode_address, reverse_geocode, compute_scores,
-    places_nearby_all, filter_by_rating_df
+    geocode_address, reverse_geocode, compute_scores, filter_by_rating_df
 )
+from search import stream_nearby
+from places_tiles import nearby_cache_stats
+from hours import open_status, prefetch_hours, hours_cache_stats
+from spatial import PlaceIndex
 from routing import (
-    route_total_seconds, optimize_route_order, compute_multi_stop_detours
+    route_total_seconds, optimize_route_order, compute_multi_stop_detours, DetourState,
+    route_cache_stats
 )
 
 # =====================================================================
@@ -37,12 +44,12 @@ from routing import (
 
 if "suggested_terms" not in st.session_state:
     st.session_state.suggested_terms = []
-if "raw_results_df" not in st.session_state:
-    st.session_state.raw_results_df = pd.DataFrame()
-if "results_df" not in st.session_state:
-    st.session_state.results_df = pd.DataFrame()
-if "selected_df" not in st.session_state:
-    st.session_state.selected_df = pd.DataFrame()
+if "results_table" not in st.session_state:
+    st.session_state.results_table = pd.DataFrame()  # resultados de la última búsqueda; no se modifica
+if "selected_ids" not in st.session_state:
+    st.session_state.selected_ids = set()  # place_id seleccionados
+if "selection_version" not in st.session_state:
+    st.session_state.selection_version = 0  # cambia con cada alta o baja en la selección
 if "center_latlon" not in st.session_state:
     st.session_state.center_latlon = (40.4168, -3.7038)  # Madrid por defecto
 if "center_address" not in st.session_state:
@@ -51,14 +58,30 @@ if "editor_nonce" not in st.session_state:
     st.session_state.editor_nonce = 0
 if "pending_resort" not in st.session_state:
     st.session_state.pending_resort = False
+if "results_page" not in st.session_state:
+    st.session_state.results_page = 0
 if "last_search_sig" not in st.session_state:
     st.session_state.last_search_sig = None
+if "results_version" not in st.session_state:
+    st.session_state.results_version = None
+if "fetched_radius" not in st.session_state:
+    st.session_state.fetched_radius = 0
+if "paging_stats" not in st.session_state:
+    st.session_state.paging_stats = {}
+if "place_index" not in st.session_state:
+    st.session_state.place_index = (None, None)  # (results_version, PlaceIndex)
 if "route_mode" not in st.session_state:
     st.session_state.route_mode = "driving"
 if "intelligent_mode" not in st.session_state:
     st.session_state.intelligent_mode = False
+if "intelligent_fast" not in st.session_state:
+    st.session_state.intelligent_fast = False
+if "detour_state" not in st.session_state:
+    st.session_state.detour_state = None
 if "optimize_waypoints" not in st.session_state:
     st.session_state.optimize_waypoints = True
+if "free_destination" not in st.session_state:
+    st.session_state.free_destination = False
 if "prev_intelligent_mode" not in st.session_state:
     st.session_state.prev_intelligent_mode = st.session_state.intelligent_mode
 if "empathy_message" not in st.session_state:
@@ -66,6 +89,28 @@ if "empathy_message" not in st.session_state:
 if "recent_terms" not in st.session_state:
     st.session_state.recent_terms = []  # para evitar repetir siempre lo mismo
 
+def set_selected(place_id: str, selected: bool):
+    """Marca o desmarca un lugar; solo cambia el conjunto de place_id y su versión."""
+    ids = st.session_state.selected_ids
+    if selected and place_id not in ids:
+        ids.add(place_id)
+    elif not selected and place_id in ids:
+        ids.discard(place_id)
+    else:
+        return
+    st.session_state.selection_version += 1
+
+def selected_view() -> pd.DataFrame:
+    """Filas de los seleccionados, en el orden de los resultados. Se recalcula solo cuando cambian
+    los resultados o la selección."""
+    key = (st.session_state.results_version, st.session_state.selection_version)
+    memo = st.session_state.get("selected_view_memo")
+    if memo is None or memo[0] != key:
+        table = st.session_state.results_table
+        view = table[table["place_id"].isin(st.session_state.selected_ids)] if not table.empty else pd.DataFrame()
+        st.session_state.selected_view_memo = memo = (key, view)
+    return memo[1]
+
 # =====================================================================
 # ======================  INTERFAZ  ===================================
 # =====================================================================
@@ -89,10 +134,28 @@ if st.sidebar.button("📍 Usar esta dirección"):
 radius = st.sidebar.slider("Radio de búsqueda (m)", min_value=200, max_value=5000, value=1500, step=100)
 open_now = st.sidebar.checkbox("Solo abiertos ahora", value=True)
 min_rating = st.sidebar.slider("Puntuación mínima", min_value=0.0, max_value=5.0, value=0.0, step=0.1)
+top_k_mode = st.sidebar.checkbox(
+    f"Búsqueda rápida (top {NEARBY_TOP_K})", value=False,
+    help="Deja de pedir páginas a Google cuando las siguientes ya no pueden entrar en el top por score."
+)
 
 st.sidebar.caption(f"Dirección actual: {st.session_state.center_address}")
 st.sidebar.map(pd.DataFrame([{"lat": st.session_state.center_latlon[0], "lon": st.session_state.center_latlon[1]}]))
 
+with st.sidebar.expander("⚙️ Cachés de Google"):
+    rs = route_cache_stats()
+    st.caption(f"Rutas: {rs['entries']} entradas · {rs['hit_rate']:.0%} aciertos ({rs['hits']}/{rs['hits'] + rs['misses']})")
+    ns = nearby_cache_stats()
+    st.caption(f"Teselas Nearby: {ns['entries']} entradas · {ns['hit_rate']:.0%} aciertos ({ns['hits']}/{ns['hits'] + ns['misses']})")
+    ls = LLM_CACHE.stats()
+    st.caption(f"Gemini: {ls['entries']} respuestas · {ls['hit_rate']:.0%} aciertos ({ls['near_hits']} por similitud)")
+    hs = hours_cache_stats()
+    st.caption(f"Horarios: {hs['entries']} lugares · {hs['hit_rate']:.0%} aciertos ({hs['hits']}/{hs['hits'] + hs['misses']})")
+    ds = details_cache_stats()
+    st.caption(f"Fichas: {ds['entries']} lugares · {ds['hit_rate']:.0%} aciertos ({ds['hits']}/{ds['hits'] + ds['misses']})")
+    ps = photo_cache_stats()
+    st.caption(f"Fotos: {ps['bytes'] / 1e6:.1f} MB · {ps['hit_rate']:.0%} aciertos ({ps['hits']}/{ps['hits'] + ps['misses']})")
+
 # Paso 1: emociones → lugares
 st.subheader("1) Dime cómo te sientes")
 mood_text = st.text_area("Tu estado de ánimo:", placeholder="Ej.: Estoy estresado, me vendría bien desconectar...")
@@ -106,17 +169,13 @@ def _remove_term(idx: int):
 
 if st.button("🎯 Recomendar lugares"):
     if mood_text.strip():
-        try:
-            empathy, places_raw, cat = gemini_brain(mood_text, avoid_terms=st.session_state.recent_terms)
-            # Normaliza a keywords Nearby
-            places = normalize_to_nearby_keywords(places_raw, cat or "neutro", avoid=st.session_state.recent_terms)
-            st.session_state.empathy_message = empathy
-            st.session_state.suggested_terms = places
+        # Gemini con plazo; si no llega a tiempo, heurística local (calculada en paralelo)
+        empathy, places, source = brain_answer(mood_text, avoid_terms=st.session_state.recent_terms)
+        st.session_state.empathy_message = empathy
+        st.session_state.suggested_terms = places
+        if source == "gemini":
             # Actualiza recientes
             st.session_state.recent_terms = list(dict.fromkeys((st.session_state.recent_terms + places)))[-24:]
-        except Exception:
-            st.session_state.empathy_message = _fallback_empathy(mood_text)
-            st.session_state.suggested_terms = mock_from_mood(mood_text, avoid=st.session_state.recent_terms)
 
 # Mostrar mensaje empático si existe
 if st.session_state.empathy_message:
@@ -168,89 +227,76 @@ place_terms = st.session_state.suggested_terms
 # ======================  BÚSQUEDA NEARBY  ============================
 # =====================================================================
 
-def compute_nearby_df(terms: list[str], center_latlon, radius, open_now, language="es") -> pd.DataFrame:
-    from maps_io import _maps_link  # import local para construir link
-    by_id = {}
-    for term in terms:
-        results = places_nearby_all(center_latlon, term, radius=radius, open_now=open_now, language=language)
-        if not results and open_now:
-            results = places_nearby_all(center_latlon, term, radius=radius, open_now=False, language=language)
-        for p in results:
-            locp = p.get("geometry", {}).get("location", {})
-            pid = p.get("place_id")
-            if not pid:
-                continue
-            photos = p.get("photos", []) or []
-            photo_ref = photos[0].get("photo_reference") if (photos and isinstance(photos[0], dict)) else None
-
-            if pid in by_id:
-                by_id[pid]["_sug_set"].add(term)
-                if p.get("rating", 0) and (p.get("rating", 0) > by_id[pid].get("rating", 0)):
-                    by_id[pid]["rating"] = p.get("rating")
-                if p.get("user_ratings_total", 0) and (p.get("user_ratings_total", 0) > by_id[pid].get("user_ratings_total", 0)):
-                    by_id[pid]["user_ratings_total"] = p.get("user_ratings_total")
-                if (not by_id[pid].get("photo_ref")) and photo_ref:
-                    by_id[pid]["photo_ref"] = photo_ref
-                continue
-
-            by_id[pid] = {
-                "✅": False,
-                "_sug_set": set([term]),
-                "sugerencia": term,
-                "name": p.get("name"),
-                "rating": p.get("rating"),
-                "user_ratings_total": p.get("user_ratings_total"),
-                "address": p.get("vicinity"),
-                "lat": locp.get("lat"),
-                "lon": locp.get("lng"),
-                "place_id": pid,
-                "maps_link": _maps_link(locp.get("lat"), locp.get("lng")),
-                "photo_ref": photo_ref,
-            }
-    rows = []
-    for rec in by_id.values():
-        rec["sugerencia"] = ", ".join(sorted(rec["_sug_set"]))
-        rec.pop("_sug_set", None)
-        rows.append(rec)
-
-    df = pd.DataFrame(rows)
-    df = compute_scores(df, center_latlon, radius, w_rating=W_RATING, w_reviews=W_REVIEWS, w_prox=W_PROX)
-    df = df.sort_values(by=["score"], ascending=[False]).reset_index(drop=True)
+st.subheader("2) 🔎 Resultados cerca")
+live_results = st.empty()
+
+PREVIEW_COLUMNS = {"name": "Nombre", "sugerencia": "Coincidió con", "score": "Score",
+                   "distance_m": "Distancia (m)", "rating": "Rating", "user_ratings_total": "Reseñas"}
+
+def compute_nearby_df(terms: list[str], center_latlon, radius, language="es", version=None,
+                      live=None, preview_rows: int = 20, top_k=None, stats=None) -> pd.DataFrame:
+    """Consume la búsqueda progresiva; si se pasa `live` (st.empty), pinta el top según llegan páginas
+    (con PlaceIndex.top_k: montículo acotado, sin ordenar lo acumulado)."""
+    df = pd.DataFrame()
+    for df in stream_nearby(terms, center_latlon, radius, language=language, version=version,
+                            top_k=top_k, stats=stats):
+        if live is not None and not df.empty:
+            with live.container():
+                st.caption(f"Buscando… {len(df)} lugares encontrados hasta ahora.")
+                top = PlaceIndex.from_df(df).top_k(center_latlon, radius, preview_rows, df["score"].to_numpy())
+                st.dataframe(df.iloc[top][list(PREVIEW_COLUMNS)].rename(columns=PREVIEW_COLUMNS),
+                             hide_index=True, width="stretch")
+    if live is not None:
+        live.empty()
     return df
 
-# Firma de búsqueda
-search_sig = (tuple(sorted(place_terms)), st.session_state.center_latlon, int(radius), bool(open_now))
+# Firma de búsqueda (sin el radio: si se reduce, basta con consultar el índice espacial; sin
+# "solo abiertos": es un filtro local sobre los horarios en caché)
+search_sig = (tuple(sorted(place_terms)), st.session_state.center_latlon, bool(top_k_mode))
 
 if place_terms:
-    if st.session_state.last_search_sig != search_sig:
-        new_df = compute_nearby_df(place_terms, st.session_state.center_latlon, radius, open_now, language="es")
-
-        if not st.session_state.raw_results_df.empty and "place_id" in st.session_state.raw_results_df.columns:
-            prev = st.session_state.raw_results_df[["place_id", "✅"]].drop_duplicates("place_id")
-            new_df = new_df.merge(prev, on="place_id", how="left", suffixes=("", "_old"))
-            if "✅_old" in new_df.columns:
-                new_df.loc[:, "✅"] = new_df["✅"].eq(True) | new_df["✅_old"].eq(True)
-                new_df.drop(columns=["✅_old"], inplace=True)
-
-        if "✅" in new_df.columns:
-            new_df["✅"] = new_df["✅"].astype(bool)
-            sort_cols = ["✅", "score"] if new_df["✅"].any() else ["score"]
-            new_df = new_df.sort_values(by=sort_cols, ascending=[False] * len(sort_cols)).reset_index(drop=True)
-
-        st.session_state.raw_results_df = new_df
+    if st.session_state.last_search_sig != search_sig or int(radius) > st.session_state.fetched_radius:
+        # Identificador del conjunto de resultados (memo de scores)
+        st.session_state.results_version = uuid.uuid4().hex
+        paging_stats = {}
+        new_df = compute_nearby_df(place_terms, st.session_state.center_latlon, radius, language="es",
+                                   version=st.session_state.results_version, live=live_results,
+                                   top_k=NEARBY_TOP_K if top_k_mode else None, stats=paging_stats)
+        st.session_state.paging_stats = paging_stats
+
+        # La selección se conserva para los lugares que siguen apareciendo en la búsqueda nueva
+        kept = st.session_state.selected_ids & set(new_df["place_id"]) if not new_df.empty else set()
+        if kept != st.session_state.selected_ids:
+            st.session_state.selected_ids = kept
+            st.session_state.selection_version += 1
+
+        st.session_state.results_table = new_df
         st.session_state.last_search_sig = search_sig
+        st.session_state.fetched_radius = int(radius)
         st.session_state.pending_resort = True
+        st.session_state.results_page = 0
 else:
-    if not st.session_state.raw_results_df.empty:
-        st.session_state.raw_results_df = pd.DataFrame()
-        st.session_state.results_df = pd.DataFrame()
-        st.session_state.selected_df = pd.DataFrame()
+    if not st.session_state.results_table.empty:
+        st.session_state.results_table = pd.DataFrame()
+        st.session_state.selected_ids = set()
+        st.session_state.selection_version += 1
+
+if top_k_mode and st.session_state.paging_stats.get("skipped_pages"):
+    ps = st.session_state.paging_stats
+    st.caption(f"⚡ Búsqueda rápida: {ps['pages']} páginas pedidas, {ps['skipped_pages']} omitidas "
+               f"(no podían cambiar el top {NEARBY_TOP_K}).")
 
 # =====================================================================
 # ======================  RESULTADOS CERCA  ============================
 # =====================================================================
 
-st.subheader("2) 🔎 Resultados cerca")
+# Orden de la tabla: etiqueta → (columna, ascendente). Los seleccionados van siempre primero.
+RESULTS_SORT_OPTIONS = {
+    "Score": ("score", False),
+    "Distancia": ("distance_m", True),
+    "Rating": ("rating", False),
+    "Reseñas": ("user_ratings_total", False),
+}
 
 new_intelligent_mode = st.checkbox(
     "🧠 Modo inteligente (cálculo de desvíos y etiquetas de ruta)",
@@ -270,21 +316,42 @@ if new_intelligent_mode != st.session_state.prev_intelligent_mode:
 st.session_state.intelligent_mode = new_intelligent_mode
 if st.session_state.intelligent_mode:
     st.caption("Calculamos el impacto en tu ruta para priorizar lugares que te pillen de camino.")
-
-def _sync_results_back_to_raw():
-    if "results_df" in st.session_state and isinstance(st.session_state.results_df, pd.DataFrame) and not st.session_state.results_df.empty:
-        res = st.session_state.results_df[["place_id", "✅"]].dropna(subset=["place_id"]).drop_duplicates("place_id")
-        raw = st.session_state.raw_results_df
-        if not raw.empty:
-            raw = raw.merge(res, on="place_id", how="left", suffixes=("", "_new"))
-            if "✅_new" in raw.columns:
-                raw.loc[:, "✅"] = raw["✅_new"].combine_first(raw["✅"]).eq(True)
-                raw = raw.drop(columns=["✅_new"])
-            st.session_state.raw_results_df = raw
-
-if not st.session_state.raw_results_df.empty:
-    base = st.session_state.raw_results_df.copy()
-    base = compute_scores(base, st.session_state.center_latlon, radius, w_rating=W_RATING, w_reviews=W_REVIEWS, w_prox=W_PROX)
+    precision = st.radio(
+        "Precisión de las etiquetas:",
+        ["exacta", "rápida"],
+        horizontal=True,
+        index=1 if st.session_state.intelligent_fast else 0,
+        help="Rápida: estimación local por distancia (instantánea, sin cuota). Exacta: consulta Google solo para los casos dudosos."
+    )
+    st.session_state.intelligent_fast = (precision == "rápida")
+
+table = st.session_state.results_table
+if not table.empty:
+    # Índice espacial del conjunto actual: el radio se aplica consultándolo, sin volver a buscar
+    if st.session_state.place_index[0] != st.session_state.results_version:
+        st.session_state.place_index = (st.session_state.results_version, PlaceIndex.from_df(table))
+    in_radius = st.session_state.place_index[1].query_radius(st.session_state.center_latlon, radius)
+    # Los seleccionados se mantienen aunque queden fuera del radio
+    selected_ids = st.session_state.selected_ids
+    checked_pos = np.flatnonzero(table["place_id"].isin(selected_ids).to_numpy())
+    base = table.iloc[np.union1d(in_radius, checked_pos)].reset_index(drop=True)
+    base["✅"] = base["place_id"].isin(selected_ids)
+    open_state = {}
+    if open_now:
+        # Filtro local con lo que hay en caché (foto de open_now de Nearby o periodos de Details), sin
+        # esperar a Google: los lugares sin horario conocido se muestran y su horario se pide más abajo
+        open_state = open_status(base["place_id"].tolist(), fetch=False, language="es")
+        state = base["place_id"].astype(str).map(open_state)
+        not_closed = state.ne(False)
+        if not_closed.any():
+            base = base[not_closed | base["✅"].eq(True)].reset_index(drop=True)
+            unknown = int(state[not_closed].isna().sum())
+            if unknown:
+                st.caption(f"{unknown} lugares sin horario conocido todavía; se muestran hasta saber si están abiertos.")
+        else:
+            st.caption("Ninguno consta como abierto ahora; se muestran todos.")
+    base = compute_scores(base, st.session_state.center_latlon, radius, w_rating=W_RATING, w_reviews=W_REVIEWS, w_prox=W_PROX,
+                          version=st.session_state.results_version)
 
     # Ruta base para etiquetas, si procede
     selected_coords = []
@@ -295,11 +362,18 @@ if not st.session_state.raw_results_df.empty:
                 selected_coords.append((float(r["lat"]), float(r["lon"])))
 
     if st.session_state.intelligent_mode and len(selected_coords) >= 1:
+        # Estado incremental de desvíos: se rehace solo si cambian origen, modo o candidatos
+        ds = st.session_state.detour_state
+        if ds is None or not ds.matches(st.session_state.center_address, st.session_state.route_mode, base):
+            st.session_state.detour_state = DetourState(st.session_state.center_address, st.session_state.route_mode, base)
         base = compute_multi_stop_detours(
             origin_text=st.session_state.center_address,
             selected_coords=selected_coords,
             candidates_df=base,
-            mode=st.session_state.route_mode
+            mode=st.session_state.route_mode,
+            origin_latlon=st.session_state.center_latlon,
+            fast=st.session_state.intelligent_fast,
+            state=st.session_state.detour_state
         )
         if "ruta" not in base.columns:
             base["ruta"] = ""
@@ -308,22 +382,55 @@ if not st.session_state.raw_results_df.empty:
         base["detour_ratio"] = np.nan
         base["ruta"] = ""
 
+    # ---------- Orden y filtro de la tabla ----------
+    def _reset_page():
+        st.session_state.results_page = 0
+
+    ctrl = st.columns([1.2, 2.0], gap="small")
+    with ctrl[0]:
+        sort_label = st.selectbox("Ordenar por", list(RESULTS_SORT_OPTIONS), key="results_sort", on_change=_reset_page)
+    with ctrl[1]:
+        name_filter = st.text_input("Filtrar por nombre", key="results_filter", on_change=_reset_page).strip()
+
     view_df = filter_by_rating_df(base, min_rating=min_rating)
     if "✅" in view_df.columns:
         view_df.loc[:, "✅"] = view_df["✅"].astype(bool)
-    sort_cols = ["✅", "score"] if (st.session_state.get("pending_resort", False) or (not view_df.empty and view_df["✅"].any())) else ["score"]
-    view_df = view_df.sort_values(by=sort_cols, ascending=[False] * len(sort_cols)).reset_index(drop=True)
+    if name_filter:
+        view_df = view_df[view_df["name"].fillna("").str.contains(name_filter, case=False, regex=False)]
+    sort_col, sort_asc = RESULTS_SORT_OPTIONS[sort_label]
+    checked_first = st.session_state.get("pending_resort", False) or (not view_df.empty and view_df["✅"].any())
+    sort_cols = (["✅"] if checked_first else []) + [sort_col]
+    view_df = view_df.sort_values(by=sort_cols, ascending=[False] * (len(sort_cols) - 1) + [sort_asc],
+                                  kind="stable", na_position="last").reset_index(drop=True)
     st.session_state.pending_resort = False
 
+    # ---------- Página actual: solo se crean widgets para estas filas ----------
+    n_pages = max(1, -(-len(view_df) // RESULTS_PAGE_SIZE))
+    page = min(st.session_state.results_page, n_pages - 1)
+    st.session_state.results_page = page
+    start = page * RESULTS_PAGE_SIZE
+    page_df = view_df.iloc[start:start + RESULTS_PAGE_SIZE]
+
+    def _go_page(p: int):
+        st.session_state.results_page = p
+
+    nav = st.columns([0.5, 3.0, 0.5], gap="small", vertical_alignment="center")
+    with nav[0]:
+        st.button("◀", key="page_prev", disabled=page == 0, on_click=_go_page, args=(page - 1,), width="stretch")
+    with nav[1]:
+        st.caption(f"Página {page + 1} de {n_pages} · filas {min(start + 1, len(view_df))}–{start + len(page_df)} de {len(view_df)}")
+    with nav[2]:
+        st.button("▶", key="page_next", disabled=page >= n_pages - 1, on_click=_go_page, args=(page + 1,), width="stretch")
+
+    # Fichas de las primeras filas de la página en segundo plano; el resto se pide al abrir su popover
+    prefetch_details(page_df["place_id"].head(DETAILS_PREFETCH_TOP_N).tolist())
+    if open_now:
+        # Horarios desconocidos de la página visible, en segundo plano
+        prefetch_hours([pid for pid in page_df["place_id"].astype(str) if open_state.get(pid) is None])
+
     # ---------- Tabla ----------
     def _toggle_check(place_id: str):
-        val = st.session_state.get(f"rowcheck_{place_id}", False)
-        raw = st.session_state.raw_results_df
-        mask = raw["place_id"] == place_id
-        if mask.any():
-            raw.loc[mask, "✅"] = bool(val)
-            st.session_state.raw_results_df = raw
-        st.session_state.selected_df = st.session_state.raw_results_df[st.session_state.raw_results_df["✅"] == True].copy()  # noqa
+        set_selected(place_id, bool(st.session_state.get(f"rowcheck_{place_id}", False)))
 
     header_cols = ["✅", "Nombre", "Coincidió con", "Ruta" if st.session_state.intelligent_mode else None,
                    "Score", "Distancia (m)", "Rating", "Reseñas"]
@@ -335,7 +442,7 @@ if not st.session_state.raw_results_df.empty:
         c.markdown(f"**{h}**")
 
     with st.container(height=LIST_CONTAINER_HEIGHT_PX, border=True, width="stretch"):
-        for _, row in view_df.iterrows():
+        for _, row in page_df.iterrows():
             place_id = str(row.get("place_id"))
             name = row.get("name") or "Lugar"
             sug = row.get("sugerencia", "")
@@ -361,59 +468,68 @@ if not st.session_state.raw_results_df.empty:
                 )
 
             with cols[1]:
-                with st.popover(name, width="stretch"):
-                    details = get_place_details(place_id)
-                    # Foto
-                    photo_shown = False
-                    try:
-                        photos = details.get("photos", []) or []
-                        pref = None
-                        if photos and isinstance(photos[0], dict):
-                            pref = photos[0].get("photo_reference")
-                        if not pref:
-                            pref = fallback_photo_ref
-                        if pref:
-                            st.image(place_photo_url(pref, maxwidth=640), width="stretch")
-                            photo_shown = True
-                    except Exception:
-                        pass
-                    if not photo_shown:
-                        st.caption("Sin foto principal disponible.")
-
-                    # Cabecera rating / reseñas
-                    r = details.get("rating", rating)
-                    ur = details.get("user_ratings_total", reviews_n)
-                    head_bits = []
-                    if r is not None and str(r) != "nan":
-                        head_bits.append(f"⭐ {r}")
-                    if ur is not None and str(ur) != "nan":
-                        head_bits.append(f"· {int(ur)} reseñas")
-                    if head_bits:
-                        st.markdown("**" + " ".join(head_bits) + "**")
-
-                    # Reseñas destacadas
-                    reviews = details.get("reviews") or []
-                    parsed = []
-                    for rev in reviews[:3]:
-                        author = rev.get("author_name") or rev.get("authorAttribution", {}).get("displayName") or "Usuario"
-                        rr = rev.get("rating", "")
-                        when = rev.get("relative_time_description") or rev.get("publishTime", "")
-                        text = rev.get("text", "")
-                        if isinstance(text, dict):
-                            text = text.get("text", "")
-                        text = (text or "").strip()
-                        parsed.append((author, rr, when, text))
-                    if parsed:
-                        st.markdown("---")
-                        st.markdown("**Reseñas destacadas:**")
-                        for (auth, rr, when, txt) in parsed:
-                            st.markdown(f"**{auth}** — ⭐ {rr} · _{when}_  \n{txt if txt else '_(sin texto)_' }")
-                    else:
-                        st.caption("Sin reseñas públicas.")
-
-                    maps_url = details.get("url") or row.get("maps_link")
-                    if maps_url:
-                        st.markdown(f"[Ver en Google Maps ↗]({maps_url})")
+                # Con on_change="rerun" el cuerpo solo se ejecuta con el popover abierto
+                pop = st.popover(name, width="stretch", key=f"pop_{place_id}", on_change="rerun")
+                with pop:
+                    if pop.open:
+                        # Cabecera, foto y enlace con el nivel "basic"; las reseñas ("rich") solo si se piden
+                        details = get_details(place_id, tier="basic")
+                        # Foto
+                        photo_shown = False
+                        try:
+                            photos = details.get("photos", []) or []
+                            pref = None
+                            if photos and isinstance(photos[0], dict):
+                                pref = photos[0].get("photo_reference")
+                            if not pref:
+                                pref = fallback_photo_ref
+                            if pref:
+                                img = photo_bytes(pref, "popover")
+                                if img:
+                                    st.image(img, width="stretch")
+                                    photo_shown = True
+                        except Exception:
+                            pass
+                        if not photo_shown:
+                            st.caption("Sin foto principal disponible.")
+
+                        # Cabecera rating / reseñas
+                        r = details.get("rating", rating)
+                        ur = details.get("user_ratings_total", reviews_n)
+                        head_bits = []
+                        if r is not None and str(r) != "nan":
+                            head_bits.append(f"⭐ {r}")
+                        if ur is not None and str(ur) != "nan":
+                            head_bits.append(f"· {int(ur)} reseñas")
+                        if head_bits:
+                            st.markdown("**" + " ".join(head_bits) + "**")
+
+                        # Reseñas destacadas
+                        rich = peek_details([place_id], tier="rich").get(place_id)
+                        if rich is None and st.toggle("Ver reseñas", key=f"reviews_{place_id}"):
+                            rich = get_details(place_id, tier="rich")
+                        reviews = (rich or {}).get("reviews") or []
+                        parsed = []
+                        for rev in reviews[:3]:
+                            author = rev.get("author_name") or rev.get("authorAttribution", {}).get("displayName") or "Usuario"
+                            rr = rev.get("rating", "")
+                            when = rev.get("relative_time_description") or rev.get("publishTime", "")
+                            text = rev.get("text", "")
+                            if isinstance(text, dict):
+                                text = text.get("text", "")
+                            text = (text or "").strip()
+                            parsed.append((author, rr, when, text))
+                        if parsed:
+                            st.markdown("---")
+                            st.markdown("**Reseñas destacadas:**")
+                            for (auth, rr, when, txt) in parsed:
+                                st.markdown(f"**{auth}** — ⭐ {rr} · _{when}_  \n{txt if txt else '_(sin texto)_' }")
+                        elif rich is not None:
+                            st.caption("Sin reseñas públicas.")
+
+                        maps_url = details.get("url") or row.get("maps_link")
+                        if maps_url:
+                            st.markdown(f"[Ver en Google Maps ↗]({maps_url})")
 
             with cols[2]:
                 st.write(sug if sug else "")
@@ -439,9 +555,6 @@ if not st.session_state.raw_results_df.empty:
             with cols[idx]:
                 st.write("" if (reviews_n is None or str(reviews_n) == "nan") else int(reviews_n))
 
-    st.session_state.results_df = view_df.copy()
-    _sync_results_back_to_raw()
-    st.session_state.selected_df = st.session_state.raw_results_df[st.session_state.raw_results_df["✅"] == True].copy()  # noqa
 else:
     st.info("No hay resultados aún. Añade o recomiende términos arriba para empezar.")
 
@@ -452,14 +565,9 @@ else:
 st.subheader("3) ✅ Tus seleccionados")
 
 def _on_remove_selected(place_id: str):
-    if "raw_results_df" in st.session_state and isinstance(st.session_state.raw_results_df, pd.DataFrame) and not st.session_state.raw_results_df.empty:
-        mask_raw = st.session_state.raw_results_df["place_id"] == place_id
-        if mask_raw.any():
-            st.session_state.raw_results_df.loc[mask_raw, "✅"] = False
-    if "raw_results_df" in st.session_state and not st.session_state.raw_results_df.empty:
-        st.session_state.selected_df = st.session_state.raw_results_df[st.session_state.raw_results_df["✅"] == True].copy()  # noqa
-    else:
-        st.session_state.selected_df = pd.DataFrame()
+    set_selected(place_id, False)
+    # La casilla de la tabla vuelve a tomar su valor de la selección
+    st.session_state.pop(f"rowcheck_{place_id}", None)
     st.session_state.editor_nonce += 1
     st.rerun()
 
@@ -484,6 +592,12 @@ def render_selected_cards(df: pd.DataFrame, cards_per_row: int = 2):
 
                 header_cols = st.columns([0.8, 0.2], gap="small")
                 with header_cols[0]:
+                    try:
+                        thumb = photo_bytes(row.get("photo_ref"), "thumb") if isinstance(row.get("photo_ref"), str) else None
+                        if thumb:
+                            st.image(thumb, width=PHOTO_THUMB_WIDTH)
+                    except Exception:
+                        pass
                     st.markdown(f"**{name}**")
                     sub = addr
                     if rating is not None and str(rating) != "nan":
@@ -503,13 +617,13 @@ def render_selected_cards(df: pd.DataFrame, cards_per_row: int = 2):
                     )
                 st.markdown("<hr style='margin:6px 0; opacity:0.2;'>", unsafe_allow_html=True)
 
-render_selected_cards(st.session_state.selected_df, cards_per_row=2)
+render_selected_cards(selected_view(), cards_per_row=2)
 
 # =====================================================================
 # ======================  RUTA FINAL  =================================
 # =====================================================================
 
-if not st.session_state.selected_df.empty:
+if not selected_view().empty:
     st.subheader("4) 🗺️ Ruta")
     st.caption(
         "Muestra la ruta usando Google Maps. Este bloque solo construye el enlace/iframe "
@@ -527,11 +641,19 @@ if not st.session_state.selected_df.empty:
     st.session_state.optimize_waypoints = st.checkbox(
         "Optimizar el orden de paradas para una ruta más corta",
         value=st.session_state.optimize_waypoints,
-        help="Usa la API de Directions para encontrar el orden óptimo de las paradas (origen = tu dirección actual; destino = la última selección)."
+        help="Calcula en local el orden óptimo de las paradas sobre una matriz de tiempos (origen = tu dirección actual) y solo pide a Google la ruta final."
     )
+    if st.session_state.optimize_waypoints:
+        st.session_state.free_destination = st.checkbox(
+            "Destino libre (terminar en la parada que más convenga)",
+            value=st.session_state.free_destination,
+            help="Si está desmarcado, el destino es siempre la última selección."
+        )
 
-    selected_rows = st.session_state.selected_df.to_dict("records")
-    selected_coords = [(float(r["lat"]), float(r["lon"])) for r in selected_rows if pd.notna(r.get("lat")) and pd.notna(r.get("lon"))]
+    selected_rows = selected_view().to_dict("records")
+    selected_rows = [r for r in selected_rows if pd.notna(r.get("lat")) and pd.notna(r.get("lon"))]
+    selected_coords = [(float(r["lat"]), float(r["lon"])) for r in selected_rows]
+    dest_row = selected_rows[-1] if selected_rows else None
 
     ordered_waypoints = []
     dest_latlon = None
@@ -541,10 +663,14 @@ if not st.session_state.selected_df.empty:
         order_idx, ordered_waypoints, dest_latlon, total_secs = optimize_route_order(
             origin_text=st.session_state.center_address,
             stops_latlon=selected_coords,
-            mode=st.session_state.route_mode
+            mode=st.session_state.route_mode,
+            fixed_dest=not st.session_state.free_destination
         )
         if dest_latlon is None and selected_coords:
             dest_latlon = selected_coords[-1]
+        elif selected_coords:
+            dest_idx = (set(range(len(selected_coords))) - set(order_idx)).pop()
+            dest_row = selected_rows[dest_idx]
     else:
         if len(selected_coords) >= 1:
             dest_latlon = selected_coords[-1]
@@ -560,8 +686,6 @@ if not st.session_state.selected_df.empty:
         mins = int(round(total_secs / 60.0))
         st.caption(f"Duración estimada total: ~{mins} min (según Google Directions).")
 
-    dest_row = selected_rows[-1] if selected_rows else None
-
     if st.button("🗺️ Ver ruta en el mapa (iframe)"):
         url = gm_embed_directions_url(
             origin_text=st.session_state.center_address,
@@ -578,6 +702,6 @@ if not st.session_state.selected_df.empty:
         dest_text=dest_row.get("address") if dest_row else None,
         mode=st.session_state.route_mode,
         waypoints_latlon=ordered_waypoints if ordered_waypoints else None,
-        optimize_waypoints=st.session_state.optimize_waypoints
+        optimize_waypoints=False  # el orden ya viene optimizado en local
     )
     st.markdown(f"[Abrir en Google Maps ↗]({maps_url})")
@@ -0,0 +1,187 @@
+# batch_moods.py — Análisis por lotes de textos de estado de ánimo (sin Streamlit)
+# Lee un JSONL en streaming, clasifica cada texto y normaliza sus términos a keywords Nearby en trozos
+# repartidos entre procesos, y escribe JSONL o Parquet. Solo hay unos pocos trozos en vuelo a la vez,
+# así que la memoria no depende del tamaño del fichero.
+#   python batch_moods.py moods.jsonl salida.jsonl --field text --terms-field place_types
+#   python batch_moods.py requests.jsonl salida.parquet --field title --field body
+
+import argparse
+import json
+import multiprocessing as mp
+import random
+import sys
+import time
+from collections import Counter, deque
+from itertools import islice
+
+DEFAULT_CHUNK_SIZE = 2000
+
+def _read_chunks(path: str, chunk_size: int):
+    with open(path, encoding="utf-8") as fh:
+        while True:
+            lines = list(islice(fh, chunk_size))
+            if not lines:
+                return
+            yield lines
+
+def _extract(line: str, fields: list[str], terms_field: str | None):
+    try:
+        rec = json.loads(line)
+    except ValueError:
+        return None
+    if not isinstance(rec, dict):
+        return None
+    text = " ".join(str(rec[f]) for f in fields if rec.get(f))
+    if not text.strip():
+        return None
+    terms = rec.get(terms_field) if terms_field else None
+    if isinstance(terms, str):
+        terms = [t.strip() for t in terms.split(",") if t.strip()]
+    return rec, text, terms
+
+def process_chunk(lines: list[str], fields: list[str], terms_field: str | None, id_field: str | None) -> tuple[list[dict], int]:
+    """Procesa un trozo de líneas: devuelve (filas de salida, líneas descartadas)."""
+    from brain import classify_mood, normalize_to_nearby_keywords, get_model
+    from taxonomy import map_terms_to_canon, _canon_lookup, _norm
+
+    model = get_model()
+    rows, skipped = [], 0
+    # Los fallbacks aleatorios (canon por emoción, relleno de keywords) se siembran con el texto:
+    # la misma entrada da la misma salida sea cual sea el trozo o el proceso. El estado de `random`
+    # de quien llama (run con workers=1) se restaura al terminar
+    state = random.getstate()
+    try:
+        for line in lines:
+            parsed = _extract(line, fields, terms_field)
+            if parsed is None:
+                skipped += 1
+                continue
+            rec, text, terms = parsed
+            random.seed(text)
+            dist = classify_mood(text)
+            category = dist[0][0]
+            if not terms:
+                # Sin términos de entrada, los del modelo local para esa categoría
+                terms = model.rank_canon(text)
+            unmapped = [t for t in terms if _canon_lookup(_norm(t)) is None]
+            rows.append({
+                "id": rec.get(id_field) if id_field else None,
+                "category": category,
+                "category_share": round(dist[0][1], 4),
+                "categories": [c for c, _ in dist],
+                "terms": list(terms),
+                "canon": map_terms_to_canon(terms, category_hint=category),
+                "unmapped_terms": unmapped,
+                "keywords": normalize_to_nearby_keywords(terms, category, []),
+            })
+    finally:
+        random.setstate(state)
+    return rows, skipped
+
+class _JsonlWriter:
+    def __init__(self, path: str):
+        self.fh = open(path, "w", encoding="utf-8")
+
+    def write(self, rows: list[dict]):
+        for row in rows:
+            self.fh.write(json.dumps(row, ensure_ascii=False) + "\n")
+
+    def close(self):
+        self.fh.close()
+
+class _ParquetWriter:
+    def __init__(self, path: str):
+        try:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+        except ImportError:
+            raise SystemExit("Para escribir Parquet hace falta pyarrow (pip install pyarrow); usa .jsonl si no.")
+        self.pa = pa
+        self.schema = pa.schema([
+            ("id", pa.string()), ("category", pa.string()), ("category_share", pa.float64()),
+            ("categories", pa.list_(pa.string())), ("terms", pa.list_(pa.string())),
+            ("canon", pa.list_(pa.string())), ("unmapped_terms", pa.list_(pa.string())),
+            ("keywords", pa.list_(pa.string())),
+        ])
+        self.writer = pq.ParquetWriter(path, self.schema)
+
+    def write(self, rows: list[dict]):
+        if not rows:
+            return
+        for row in rows:
+            row["id"] = None if row["id"] is None else str(row["id"])
+        self.writer.write_table(self.pa.Table.from_pylist(rows, schema=self.schema))
+
+    def close(self):
+        self.writer.close()
+
+def run(in_path: str, out_path: str, fields: list[str], terms_field: str | None = None, id_field: str | None = None,
+        chunk_size: int = DEFAULT_CHUNK_SIZE, workers: int | None = None, log=sys.stderr) -> dict:
+    """Procesa `in_path` y escribe `out_path` (.parquet o JSONL). Devuelve estadísticas de rendimiento."""
+    writer = _ParquetWriter(out_path) if out_path.endswith(".parquet") else _JsonlWriter(out_path)
+    workers = workers or mp.cpu_count()
+    stats = {"lines": 0, "rows": 0, "skipped": 0, "unmapped_terms": 0, "terms": 0}
+    categories = Counter()
+    # El modelo se carga (o se entrena y guarda) una vez aquí: los procesos del pool solo leen
+    # un fichero completo en vez de entrenar y escribir todos a la vez
+    from mood_model import get_model
+    get_model()
+    t0 = time.perf_counter()
+
+    def _consume(result):
+        rows, skipped = result
+        writer.write(rows)
+        stats["rows"] += len(rows)
+        stats["skipped"] += skipped
+        for r in rows:
+            categories[r["category"]] += 1
+            stats["terms"] += len(r["terms"])
+            stats["unmapped_terms"] += len(r["unmapped_terms"])
+        if log is not None:
+            rate = stats["lines"] / max(1e-9, time.perf_counter() - t0)
+            print(f"{stats['lines']} líneas · {rate:,.0f} líneas/s", file=log)
+
+    try:
+        if workers <= 1:
+            for lines in _read_chunks(in_path, chunk_size):
+                stats["lines"] += len(lines)
+                _consume(process_chunk(lines, fields, terms_field, id_field))
+        else:
+            with mp.Pool(workers) as pool:
+                # Como mucho 2 trozos en vuelo por proceso; se escriben en el orden de entrada
+                pending = deque()
+                for lines in _read_chunks(in_path, chunk_size):
+                    stats["lines"] += len(lines)
+                    pending.append(pool.apply_async(process_chunk, (lines, fields, terms_field, id_field)))
+                    if len(pending) >= 2 * workers:
+                        _consume(pending.popleft().get())
+                while pending:
+                    _consume(pending.popleft().get())
+    finally:
+        writer.close()
+
+    elapsed = time.perf_counter() - t0
+    stats.update({
+        "elapsed_s": round(elapsed, 3),
+        "lines_per_s": round(stats["lines"] / elapsed, 1) if elapsed else None,
+        "unmapped_rate": round(stats["unmapped_terms"] / stats["terms"], 4) if stats["terms"] else 0.0,
+        "categories": dict(categories.most_common()),
+    })
+    return stats
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Categorías y keywords Nearby de un JSONL de textos")
+    parser.add_argument("input", help="JSONL de entrada")
+    parser.add_argument("output", help="Salida: .parquet (requiere pyarrow) o JSONL")
+    parser.add_argument("--field", action="append", help="Campo(s) con el texto (se concatenan). Por defecto: text")
+    parser.add_argument("--terms-field", help="Campo con términos a normalizar (lista o texto separado por comas)")
+    parser.add_argument("--id-field", help="Campo que se copia como id")
+    parser.add_argument("--chunk-size", type=int, default=DEFAULT_CHUNK_SIZE)
+    parser.add_argument("--workers", type=int, default=None, help="Procesos (por defecto, uno por CPU)")
+    args = parser.parse_args(argv)
+    stats = run(args.input, args.output, args.field or ["text"], args.terms_field, args.id_field,
+                args.chunk_size, args.workers)
+    print(json.dumps(stats, ensure_ascii=False, indent=2))
+
+if __name__ == "__main__":
+    main()
@@ -1,37 +1,92 @@
 import re
 import json
 import random
+from concurrent.futures import ThreadPoolExecutor
 import requests
-from config import GEMINI_API_KEY
+from requests.adapters import HTTPAdapter
+from config import GEMINI_API_KEY, GEMINI_DEADLINE_S, GEMINI_TIMEOUT_S, GEMINI_POOL_SIZE, MOOD_LOG_PATH
+from llm_cache import LLMCache
+from mood_model import get_model
 from taxonomy import (
-    CURATED_BY_CATEGORY,
     CANON_BY_EMOTION,
-    _map_term_to_canon,
+    map_terms_to_canon,
     _norm,
 )
 
+# Reglas de la heurística local: (categoría, patrones). El orden desempata categorías con los mismos aciertos.
+MOOD_RULES = [
+    ("tristeza", [
+        r"\bmuy mal\b", r"\bmal\b", r"\bfatal\b", r"\bhorrible\b", r"\bbajon\b", r"\bme siento mal\b",
+        r"\bdepre", r"\bdeprim", r"\bmelanc", r"\bdesanim", r"\bllor", r"\bvac[ií]o\b",r"\btriste\b"
+    ]),
+    ("ansiedad/estrés", [r"\bansied", r"\bnervios\b", r"\bagobio\b", r"\bestres\b", r"\bangust", r"\bpreocup"]),
+    ("ira", [r"\bira\b", r"\benfad", r"\brabia\b", r"\bfuria\b", r"\bcabre", r"\benoj"]),
+    ("cansancio", [r"\bcansancio\b", r"\bcansad", r"\bagotad", r"\bfatiga\b", r"\bburnout\b", r"\bsin fuerzas\b"]),
+    ("soledad", [r"\bsoledad\b", r"\bsolo\b", r"\bsola\b", r"\baislad", r"\baislam"]),
+    ("aburrimiento", [r"\baburr", r"\bapat", r"\bsin ganas\b", r"\bapatico\b", r"\bapatica\b"]),
+    ("felicidad", [r"\bfeliz\b", r"\bcontent", r"\balegr", r"\beufor", r"\bgenial\b", r"\bde lujo\b"]),
+    ("amor/romance", [r"\bamor\b", r"\benamora", r"\bromant", r"\bcariñ", r"\brom[aá]nt"]),
+    ("curiosidad", [r"\bcurios", r"\bcreativ", r"\binspir", r"\bexplor", r"\bdescubr"]),
+    ("calma/paz", [r"\bcalma\b", r"\bpaz\b", r"\btranquil", r"\bseren", r"\brelajad"]),
+]
+MOOD_CATEGORIES = [category for category, _ in MOOD_RULES]
+
+def _compile_mood_rules():
+    """Una sola alternancia con un grupo con nombre por patrón (c<categoría>_<patrón>). Los patrones
+    se normalizan igual que el texto (sin tildes), si no los que llevan ñ o tilde nunca casarían."""
+    parts, owner = [], {}
+    for ci, (category, pats) in enumerate(MOOD_RULES):
+        for pi, pat in enumerate(pats):
+            name = f"c{ci}_{pi}"
+            body = _norm(pat).removeprefix(r"\b")
+            parts.append(f"(?P<{name}>{body})")
+            owner[name] = ci
+    # Todos los patrones empiezan en límite de palabra: se comprueba una vez antes de la alternancia
+    return re.compile(r"\b(?:" + "|".join(parts) + ")"), owner
+
+_MOOD_RE, _MOOD_GROUP_OWNER = _compile_mood_rules()
+
+def mood_hits(mood_text: str) -> list[int]:
+    """Aciertos por categoría (en el orden de MOOD_RULES) recorriendo el texto normalizado una vez."""
+    hits = [0] * len(MOOD_RULES)
+    for m in _MOOD_RE.finditer(_norm(mood_text)):
+        hits[_MOOD_GROUP_OWNER[m.lastgroup]] += 1
+    return hits
+
+def classify_mood(mood_text: str) -> list[tuple[str, float]]:
+    """Distribución de categorías ordenada de más a menos probable (proporción de aciertos)."""
+    hits = mood_hits(mood_text)
+    total = sum(hits)
+    if not total:
+        return [("neutro", 1.0)]
+    ranked = sorted((i for i, h in enumerate(hits) if h), key=lambda i: (-hits[i], i))
+    return [(MOOD_CATEGORIES[i], hits[i] / total) for i in ranked]
+
+def classify_moods(mood_texts: list[str]) -> list[list[tuple[str, float]]]:
+    """classify_mood para muchos textos (el patrón compilado se comparte)."""
+    return [classify_mood(t) for t in mood_texts]
+
 def detect_mood_category(mood_text: str) -> str:
-    """Heurística robusta (fallback) con regex y límites de palabra."""
-    p = _norm(mood_text)
-    rules = [
-        ("tristeza", [
-            r"\bmuy mal\b", r"\bmal\b", r"\bfatal\b", r"\bhorrible\b", r"\bbajon\b", r"\bme siento mal\b",
-            r"\bdepre", r"\bdeprim", r"\bmelanc", r"\bdesanim", r"\bllor", r"\bvac[ií]o\b",r"\btriste\b"
-        ]),
-        ("ansiedad/estrés", [r"\bansied", r"\bnervios\b", r"\bagobio\b", r"\bestres\b", r"\bangust", r"\bpreocup"]),
-        ("ira", [r"\bira\b", r"\benfad", r"\brabia\b", r"\bfuria\b", r"\bcabre", r"\benoj"]),
-        ("cansancio", [r"\bcansancio\b", r"\bcansad", r"\bagotad", r"\bfatiga\b", r"\bburnout\b", r"\bsin fuerzas\b"]),
-        ("soledad", [r"\bsoledad\b", r"\bsolo\b", r"\bsola\b", r"\baislad", r"\baislam"]),
-        ("aburrimiento", [r"\baburr", r"\bapat", r"\bsin ganas\b", r"\bapatico\b", r"\bapatica\b"]),
-        ("felicidad", [r"\bfeliz\b", r"\bcontent", r"\balegr", r"\beufor", r"\bgenial\b", r"\bde lujo\b"]),
-        ("amor/romance", [r"\bamor\b", r"\benamora", r"\bromant", r"\bcariñ", r"\brom[aá]nt"]),
-        ("curiosidad", [r"\bcurios", r"\bcreativ", r"\binspir", r"\bexplor", r"\bdescubr"]),
-        ("calma/paz", [r"\bcalma\b", r"\bpaz\b", r"\btranquil", r"\bseren", r"\brelajad"]),
-    ]
-    for category, pats in rules:
-        if any(re.search(pat, p) for pat in pats):
-            return category
-    return "neutro"
+    """Categoría con más aciertos; a igualdad, la primera en MOOD_RULES. Sin aciertos, 'neutro'."""
+    return classify_mood(mood_text)[0][0]
+
+# Peso de las reglas frente al modelo local cuando alguna regla casa
+RULES_WEIGHT = 0.7
+
+def local_mood_distribution(mood_text: str) -> dict:
+    """{categoría: probabilidad} sin LLM: el modelo local (mood_model) mezclado con las reglas si alguna casa."""
+    probs = get_model().predict_proba(mood_text)
+    hits = mood_hits(mood_text)
+    total = sum(hits)
+    if total:
+        probs = {c: (1 - RULES_WEIGHT) * p for c, p in probs.items()}
+        for c, h in zip(MOOD_CATEGORIES, hits):
+            probs[c] = probs.get(c, 0.0) + RULES_WEIGHT * h / total
+    return probs
+
+def local_mood_category(mood_text: str) -> str:
+    probs = local_mood_distribution(mood_text)
+    return max(probs, key=probs.get)
 
 TONE_HINTS = {
     "tristeza":        ("cálido y suave",            "😔"),
@@ -48,7 +103,7 @@ TONE_HINTS = {
 }
 
 def _fallback_empathy(mood_text: str) -> str:
-    category = detect_mood_category(mood_text)
+    category = local_mood_category(mood_text)
     _, emoji = TONE_HINTS.get(category, TONE_HINTS["neutro"])
     templates = {
         "tristeza":        f"Siento mucho que estés pasando por esto {emoji}. Voy a recomendarte algunos lugares suaves para ayudarte un poco.",
@@ -65,12 +120,20 @@ def _fallback_empathy(mood_text: str) -> str:
     }
     return templates.get(category, templates["neutro"])
 
+# Respuestas de Gemini por (categoría local, evitados), compartidas por todas las sesiones
+LLM_CACHE = LLMCache()
+
+# Sesión HTTP con conexiones keep-alive (sin pagar TLS en cada clic) y pool para las llamadas con plazo
+_GEMINI_SESSION = requests.Session()
+_GEMINI_SESSION.mount("https://", HTTPAdapter(pool_connections=1, pool_maxsize=GEMINI_POOL_SIZE))
+_GEMINI_POOL = ThreadPoolExecutor(max_workers=GEMINI_POOL_SIZE, thread_name_prefix="gemini")
+
 PROMPT_BRAIN_JSON = """ Eres un asistente en español (España). Analiza el estado del usuario y devuelve SOLO un JSON con esta forma: 
-{
+{{
   "category": "tristeza|ansiedad/estrés|ira|cansancio|soledad|aburrimiento|felicidad|amor/romance|curiosidad|calma/paz",
   "empathy": "1-2 frases, tono acorde a la emoción, EXACTAMENTE 1 emoji, NO empieces con 'Gracias por compartir'",
   "place_types": ["3 a 6 tipos de lugares en España, minúsculas, 1-3 palabras, sin nombres propios"]
-}
+}}
 Criterios:
 - Varía los tipos de lugares; evita repetir siempre los mismos.
 - Ajusta interior/exterior y social/individual según la emoción.
@@ -87,12 +150,29 @@ Estado del usuario: «{mood}»
 Evita (si hay): {avoid}
 """.strip()
 
-def gemini_brain(mood_text: str, avoid_terms: list[str] | None = None):
-    """Devuelve (empathy_message, place_types, category) usando Gemini (JSON estricto)."""
+def _log_mood(mood_text: str, category: str):
+    """Añade (texto, categoría de Gemini) al registro con el que se reentrena mood_model."""
+    try:
+        with open(MOOD_LOG_PATH, "a", encoding="utf-8") as fh:
+            fh.write(json.dumps({"text": mood_text, "category": category}, ensure_ascii=False) + "\n")
+    except OSError:
+        pass
+
+def gemini_brain(mood_text: str, avoid_terms: list[str] | None = None, use_cache: bool = True):
+    """Devuelve (empathy_message, place_types, category) usando Gemini (JSON estricto).
+    Con `use_cache`, un texto igual o parecido con la misma categoría y evitados reutiliza la respuesta."""
     if not GEMINI_API_KEY:
         raise RuntimeError("GEMINI_API_KEY missing")
 
-    avoid = ", ".join(sorted(set((avoid_terms or [])[:12])))
+    avoid_key = sorted(set((avoid_terms or [])[:12]))
+    cache_category = detect_mood_category(mood_text)
+    if use_cache:
+        cached = LLM_CACHE.get(mood_text, cache_category, avoid_key)
+        if cached is not None:
+            empathy, places, category = cached
+            return empathy, list(places), category
+
+    avoid = ", ".join(avoid_key)
     prompt = PROMPT_BRAIN_JSON.format(mood=mood_text, avoid=avoid if avoid else "—")
 
     url = "https://generativelanguage.googleapis.com/v1beta/models/gemini-1.5-flash:generateContent"
@@ -107,7 +187,7 @@ def gemini_brain(mood_text: str, avoid_terms: list[str] | None = None):
         }
     }
     params = {"key": GEMINI_API_KEY}
-    resp = requests.post(url, headers=headers, params=params, data=json.dumps(payload), timeout=20)
+    resp = _GEMINI_SESSION.post(url, headers=headers, params=params, data=json.dumps(payload), timeout=GEMINI_TIMEOUT_S)
     resp.raise_for_status()
     data = resp.json()
 
@@ -125,14 +205,16 @@ def gemini_brain(mood_text: str, avoid_terms: list[str] | None = None):
     avoid_set = {a.lower() for a in (avoid_terms or [])}
     places = [p for p in places if p not in avoid_set]
     places = list(dict.fromkeys(places))[:6]
+    LLM_CACHE.put(mood_text, cache_category, avoid_key, (empathy, places, category))
+    if MOOD_LOG_PATH:
+        _log_mood(mood_text, category)
     return empathy, places, category
 
 def normalize_to_nearby_keywords(recommended: list[str], category: str, avoid: list[str]) -> list[str]:
     """Normaliza los tipos devueltos por Gemini a keywords viables para Nearby."""
     avoid_set = {a.lower() for a in avoid}
     out = []
-    for t in recommended:
-        canon = _map_term_to_canon(t, category_hint=category or "neutro")
+    for canon in map_terms_to_canon(recommended, category_hint=category or "neutro"):
         if canon.lower() not in avoid_set and canon not in out:
             out.append(canon)
         if len(out) >= 6:
@@ -144,14 +226,26 @@ def normalize_to_nearby_keywords(recommended: list[str], category: str, avoid: l
     return out
 
 def mock_from_mood(mood_text: str, avoid: list[str] | None = None):
-    """Fallback clásico: muestrea del curado y normaliza a keywords Nearby."""
-    category = detect_mood_category(mood_text)
-    avoid = avoid or []
-    candidates = CURATED_BY_CATEGORY.get(category, CURATED_BY_CATEGORY["neutro"])[:]
-    random.shuffle(candidates)
-    raw = []
-    for c in candidates:
-        if len(raw) >= 6:
-            break
-        raw.append(c)
-    return normalize_to_nearby_keywords(raw, category, avoid)
\ No newline at end of file
+    """Fallback local: keywords canónicas ordenadas por el modelo local; las 3 primeras fijas y
+    3 más al azar entre las siguientes, para variar entre clics."""
+    probs = local_mood_distribution(mood_text)
+    ranked = get_model().rank_canon(probs=probs, avoid=avoid, k=12)
+    rest = ranked[3:]
+    return ranked[:3] + random.sample(rest, min(3, len(rest)))
+
+def brain_answer(mood_text: str, avoid_terms: list[str] | None = None, deadline_s: float = GEMINI_DEADLINE_S):
+    """Paso 1 con plazo: devuelve (empathy_message, keywords Nearby, origen) con origen "gemini" o "local".
+
+    Gemini se lanza en segundo plano y, mientras, se calcula la respuesta local. Si Gemini no responde
+    en `deadline_s` (o falla) se devuelve la local; la respuesta tardía sigue llenando LLM_CACHE."""
+    avoid_terms = avoid_terms or []
+    future = _GEMINI_POOL.submit(gemini_brain, mood_text, avoid_terms) if GEMINI_API_KEY else None
+    local = (_fallback_empathy(mood_text), mock_from_mood(mood_text, avoid=avoid_terms))
+    if future is None:
+        return (*local, "local")
+    try:
+        empathy, places_raw, category = future.result(timeout=deadline_s)
+    except Exception:  # plazo vencido o error de Gemini
+        return (*local, "local")
+    places = normalize_to_nearby_keywords(places_raw, category or "neutro", avoid=avoid_terms)
+    return empathy, places, "gemini"
@@ -0,0 +1,110 @@
+import queue
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from config import API_MAX_WORKERS, API_REQUEST_TIMEOUT_S, DIRECTIONS_QPS, PLACES_QPS, PAGING_MAX_WORKERS
+
+class TokenBucket:
+    """Limitador de cuota: `rate` fichas por segundo con ráfaga máxima `burst`. Seguro entre hilos."""
+
+    def __init__(self, rate: float, burst: int | None = None):
+        self.rate = float(rate)
+        self.capacity = float(burst or max(1, int(rate)))
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self, deadline: float | None = None) -> bool:
+        """Espera una ficha; devuelve False si antes se alcanza `deadline` (time.monotonic)."""
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1.0:
+                    self.tokens -= 1.0
+                    return True
+                wait = (1.0 - self.tokens) / self.rate
+            if deadline is not None and time.monotonic() + wait > deadline:
+                return False
+            time.sleep(wait)
+
+# Pool y limitadores compartidos por todas las sesiones del proceso
+_POOL = ThreadPoolExecutor(max_workers=API_MAX_WORKERS, thread_name_prefix="gmaps")
+# Los productores de iter_concurrent pasan casi todo el tiempo dormidos (next_page_token): van en su
+# propio pool para no quitar hilos a Details, fotos, horarios y Distance Matrix
+_PAGING_POOL = ThreadPoolExecutor(max_workers=PAGING_MAX_WORKERS, thread_name_prefix="paging")
+BUCKETS = {
+    "directions": TokenBucket(DIRECTIONS_QPS),
+    "places": TokenBucket(PLACES_QPS),
+}
+
+def run_concurrent(calls: list, bucket: str = "directions", timeout_s: float | None = API_REQUEST_TIMEOUT_S,
+                   default=None) -> list:
+    """Ejecuta llamadas independientes (funciones sin argumentos) en el pool respetando la cuota del
+    `bucket`. Devuelve los resultados en el orden de entrada; las que fallan o superan su plazo
+    (`timeout_s` desde que se encolan) devuelven `default`."""
+    if not calls:
+        return []
+    limiter = BUCKETS[bucket]
+
+    def _job(fn, deadline):
+        if not limiter.acquire(deadline):
+            return default
+        return fn()
+
+    jobs = []
+    for fn in calls:
+        deadline = time.monotonic() + timeout_s if timeout_s is not None else None
+        jobs.append((_POOL.submit(_job, fn, deadline), deadline))
+    out = []
+    for fut, deadline in jobs:
+        try:
+            remaining = None if deadline is None else max(0.0, deadline - time.monotonic())
+            out.append(fut.result(timeout=remaining))
+        except Exception:
+            out.append(default)
+    return out
+
+def run_background(fn, bucket: str = "places"):
+    """Encola `fn` en el pool respetando la cuota del `bucket` sin esperar al resultado (devuelve el Future)."""
+    def _job():
+        BUCKETS[bucket].acquire()
+        return fn()
+    return _POOL.submit(_job)
+
+def throttle(bucket: str):
+    """Espera una ficha del limitador `bucket` (para llamadas hechas dentro de un productor)."""
+    BUCKETS[bucket].acquire()
+
+_DONE = object()
+
+def iter_concurrent(producers: list, timeout_s: float | None = None):
+    """Ejecuta varios productores (funciones que devuelven un iterable) a la vez en el pool de paginación y produce
+    (índice del productor, elemento) según van llegando. Un productor que falla simplemente termina;
+    si se agota `timeout_s` se deja de esperar al resto."""
+    results = queue.Queue()
+
+    def _run(i, make):
+        try:
+            for item in make():
+                results.put((i, item))
+        except Exception:
+            pass
+        finally:
+            results.put((i, _DONE))
+
+    for i, make in enumerate(producers):
+        _PAGING_POOL.submit(_run, i, make)
+    deadline = time.monotonic() + timeout_s if timeout_s is not None else None
+    pending = len(producers)
+    while pending:
+        try:
+            remaining = None if deadline is None else max(0.0, deadline - time.monotonic())
+            i, item = results.get(timeout=remaining)
+        except queue.Empty:
+            return
+        if item is _DONE:
+            pending -= 1
+            continue
+        yield i, item
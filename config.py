@@ -8,17 +8,63 @@ load_dotenv()
 GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
 GOOGLE_MAPS_API_KEY = os.getenv("GOOGLE_MAPS_API_KEY")
 
-if not GOOGLE_MAPS_API_KEY:
+# Solo la app necesita Google Maps; los procesos sin Streamlit (batch_moods, mood_model) funcionan sin clave
+if not GOOGLE_MAPS_API_KEY and st.runtime.exists():
     st.error("Falta GOOGLE_MAPS_API_KEY en .env")
     st.stop()
 
 # Cliente Google Maps
-gmaps = googlemaps.Client(key=GOOGLE_MAPS_API_KEY)
+gmaps = googlemaps.Client(key=GOOGLE_MAPS_API_KEY) if GOOGLE_MAPS_API_KEY else None
 
 # --------- Constantes de UI ---------
 LIST_CONTAINER_HEIGHT_PX = 720  # altura del contenedor scrollable
+RESULTS_PAGE_SIZE = 25          # filas de la tabla de resultados que se pintan a la vez
 
 # --------- Pesos del score ---------
 W_RATING = 0.5
 W_REVIEWS = 0.3
-W_PROX = 0.2
\ No newline at end of file
+W_PROX = 0.2
+
+# --------- Paginación Nearby ---------
+NEARBY_TOP_K = 20            # en modo top-K se deja de paginar cuando las páginas restantes no pueden cambiar este top
+
+# --------- Concurrencia y cuotas de Google ---------
+API_MAX_WORKERS = 8          # hilos del pool compartido de llamadas a Google
+DIRECTIONS_QPS = 10          # cuota Directions / Distance Matrix (peticiones por segundo)
+PLACES_QPS = 10              # cuota Places (Nearby / Details)
+API_REQUEST_TIMEOUT_S = 15   # plazo por petición en el pool
+PAGING_MAX_WORKERS = 16      # hilos aparte para productores de páginas (duermen 2 s por next_page_token)
+
+# --------- Cachés persistentes (SQLite en disco, compartidas entre procesos) ---------
+CACHE_DIR = os.getenv("CACHE_DIR", ".cache")
+ROUTE_CACHE_TTL_S = 7 * 24 * 3600      # duraciones por franja horaria: válidas una semana
+ROUTE_CACHE_MAX_ENTRIES = 200_000
+PLACES_CACHE_TTL_S = 7 * 24 * 3600     # retención máxima de teselas Nearby
+PLACES_CACHE_MAX_ENTRIES = 50_000
+PLACES_TILE_MAX_AGE_S = 6 * 3600       # a partir de aquí una tesela se considera obsoleta y se vuelve a pedir
+HOURS_CACHE_TTL_S = 7 * 24 * 3600      # horarios (periodos de Details) por place_id
+HOURS_CACHE_MAX_ENTRIES = 100_000
+OPEN_NOW_SNAPSHOT_MAX_AGE_S = 15 * 60  # el open_now visto en Nearby vale para "ahora" durante este tiempo
+DETAILS_CACHE_TTL_S = 24 * 3600       # ficha de un lugar (reseñas, foto, enlace): se refresca a diario
+DETAILS_CACHE_MAX_ENTRIES = 20_000
+DETAILS_PREFETCH_TOP_N = 5             # primeras filas cuya ficha se pide en segundo plano
+DETAILS_PREFETCH_MAX_INFLIGHT = 4      # peticiones de precarga a la vez, como mucho
+PHOTO_CACHE_MAX_BYTES = 200 * 1024 * 1024  # disco máximo de fotos redimensionadas (LRU por último uso)
+PHOTO_CACHE_TTL_S = 30 * 24 * 3600     # índice photo_reference → fichero
+PHOTO_CACHE_MAX_ENTRIES = 100_000
+PHOTO_THUMB_WIDTH = 160                # miniatura (tarjetas de seleccionados)
+PHOTO_POPOVER_WIDTH = 640              # foto del popover; es también el tamaño que se pide a Google
+
+# --------- Caché de respuestas de Gemini (en memoria del proceso) ---------
+LLM_CACHE_MAX_ENTRIES = 500
+LLM_CACHE_TTL_S = 3600
+LLM_CACHE_SIMILARITY = 0.85            # coseno mínimo entre trigramas para reutilizar la respuesta de un texto parecido
+
+# --------- Modelo local de estado de ánimo ---------
+MOOD_MODEL_PATH = os.getenv("MOOD_MODEL_PATH", os.path.join(CACHE_DIR, "mood_model.npz"))
+MOOD_LOG_PATH = os.getenv("MOOD_LOG_PATH")  # si se define, cada respuesta de Gemini se añade aquí (texto + categoría)
+
+# --------- Cliente de Gemini ---------
+GEMINI_DEADLINE_S = 4.0      # pasado este plazo la app responde con la heurística local (Gemini sigue y llena la caché)
+GEMINI_TIMEOUT_S = 20        # timeout HTTP de la llamada en segundo plano
+GEMINI_POOL_SIZE = 4         # conexiones keep-alive y llamadas simultáneas a Gemini
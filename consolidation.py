@@ -0,0 +1,86 @@
+import numpy as np
+import pandas as pd
+
+# La unión de términos se guarda como máscara de bits sobre la lista de términos (uint64)
+MAX_TERMS = 64
+
+APP_COLUMNS = ["name", "rating", "user_ratings_total", "address", "lat", "lon",
+               "place_id", "maps_link", "photo_ref", "sugerencia"]
+RAW_COLUMNS = ["place_id", "name", "rating", "user_ratings_total", "address", "lat", "lon", "photo_ref", "term_mask"]
+
+def pages_frame(pages) -> pd.DataFrame:
+    """Tabla columnar con todas las filas crudas de varias páginas de Nearby: pares (índice de término, resultados)."""
+    pid, name, rating, reviews, address, lat, lon, photo, term = [], [], [], [], [], [], [], [], []
+    for term_idx, results in pages:
+        if term_idx >= MAX_TERMS:
+            raise ValueError(f"Como mucho {MAX_TERMS} términos por búsqueda")
+        for p in results:
+            if not p.get("place_id"):
+                continue
+            loc = p.get("geometry", {}).get("location", {})
+            photos = p.get("photos", []) or []
+            pid.append(p["place_id"])
+            name.append(p.get("name"))
+            rating.append(p.get("rating"))
+            reviews.append(p.get("user_ratings_total"))
+            address.append(p.get("vicinity"))
+            lat.append(loc.get("lat"))
+            lon.append(loc.get("lng"))
+            photo.append(photos[0].get("photo_reference") if (photos and isinstance(photos[0], dict)) else None)
+            term.append(term_idx)
+    return pd.DataFrame({
+        "place_id": np.array(pid, dtype=object),
+        "name": np.array(name, dtype=object),
+        "rating": np.array(rating, dtype=float),
+        "user_ratings_total": np.array(reviews, dtype=float),
+        "address": np.array(address, dtype=object),
+        "lat": np.array(lat, dtype=float),
+        "lon": np.array(lon, dtype=float),
+        "photo_ref": np.array(photo, dtype=object),
+        "term_mask": np.left_shift(np.uint64(1), np.array(term, dtype=np.uint64)),
+    })
+
+def results_frame(results: list, term_idx: int) -> pd.DataFrame:
+    """Tabla columnar de una página cruda de Nearby para el término `term_idx`."""
+    return pages_frame([(term_idx, results)])
+
+def consolidate(frames) -> pd.DataFrame:
+    """Reduce filas repetidas por place_id: rating y reseñas máximos, primer valor no nulo del resto
+    y OR de las máscaras de términos. Es asociativa: se puede volver a aplicar sobre su salida más
+    páginas nuevas. Conserva el orden de primera aparición."""
+    frames = [f for f in frames if f is not None and not f.empty]
+    if not frames:
+        return pd.DataFrame(columns=RAW_COLUMNS)
+    raw = pd.concat(frames, ignore_index=True) if len(frames) > 1 else frames[0]
+    codes, uniques = pd.factorize(raw["place_id"], sort=False)
+    g = raw.groupby(codes, sort=True)
+    out = g.agg({
+        "name": "first", "rating": "max", "user_ratings_total": "max",
+        "address": "first", "lat": "first", "lon": "first", "photo_ref": "first",
+    })
+    # OR de máscaras por grupo: ordenar por código y reducir por tramos
+    order = np.argsort(codes, kind="stable")
+    starts = np.flatnonzero(np.r_[True, np.diff(codes[order]) != 0])
+    out["term_mask"] = np.bitwise_or.reduceat(raw["term_mask"].to_numpy(dtype=np.uint64)[order], starts)
+    out.insert(0, "place_id", np.asarray(uniques, dtype=object))
+    return out.reset_index(drop=True)[RAW_COLUMNS]
+
+def term_labels(masks, terms: list[str]) -> np.ndarray:
+    """Texto "Coincidió con" de cada máscara (términos ordenados alfabéticamente)."""
+    masks = np.asarray(masks, dtype=np.uint64)
+    uniq, inv = np.unique(masks, return_inverse=True)
+    labels = np.array([
+        ", ".join(sorted(t for i, t in enumerate(terms) if int(m) >> i & 1)) for m in uniq
+    ], dtype=object)
+    return labels[inv.reshape(-1)]
+
+def finalize(consolidated: pd.DataFrame, terms: list[str]) -> pd.DataFrame:
+    """Columnas que usa la app: sugerencia y maps_link, sin la máscara interna. La selección no va
+    en la tabla: la app la guarda aparte como conjunto de place_id."""
+    df = consolidated.drop(columns=["term_mask"])
+    df["maps_link"] = (
+        "https://www.google.com/maps/search/?api=1&query="
+        + df["lat"].astype(str) + "," + df["lon"].astype(str)
+    )
+    df["sugerencia"] = term_labels(consolidated["term_mask"], terms)
+    return df[APP_COLUMNS]
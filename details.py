@@ -0,0 +1,130 @@
+import os
+import threading
+from config import (
+    gmaps, CACHE_DIR, DETAILS_CACHE_TTL_S, DETAILS_CACHE_MAX_ENTRIES, DETAILS_PREFETCH_MAX_INFLIGHT
+)
+from concurrency import run_concurrent, run_background
+from disk_cache import DiskCache
+
+# Fichas de Place Details por (idioma, nivel, place_id), compartidas entre sesiones y procesos
+DETAILS_CACHE = DiskCache(os.path.join(CACHE_DIR, "details.sqlite"), DETAILS_CACHE_TTL_S, DETAILS_CACHE_MAX_ENTRIES)
+
+# Niveles de ficha: cada uno añade sus campos a los de los anteriores y se guarda por separado,
+# así que pedir "rich" sobre un lugar que ya tiene "basic" solo pide reseñas y resumen
+DETAILS_TIERS = {
+    "basic": ["name", "rating", "user_ratings_total", "url", "photo"],
+    "rich": ["reviews", "editorial_summary"],
+}
+TIER_ORDER = list(DETAILS_TIERS)
+# Campo pedido → clave en la respuesta (solo los que difieren)
+_RESPONSE_KEYS = {"photo": "photos"}
+
+# Precargas en curso: evita pedir dos veces el mismo lugar y limita las peticiones a la vez
+_inflight = set()
+_inflight_lock = threading.Lock()
+
+def _tiers_upto(tier: str) -> list[str]:
+    if tier not in DETAILS_TIERS:
+        raise ValueError(f"Nivel de ficha desconocido: {tier} (usa {', '.join(TIER_ORDER)})")
+    return TIER_ORDER[:TIER_ORDER.index(tier) + 1]
+
+def _key(place_id: str, language: str, tier: str) -> str:
+    return f"{language}|{tier}|{place_id}"
+
+def _fetch_details(place_id: str, language: str, tiers: list[str]) -> dict:
+    """{nivel: campos} de los `tiers` pedidos, en una sola llamada a Details."""
+    fields = [f for t in tiers for f in DETAILS_TIERS[t]]
+    kwargs = {"reviews_sort": "newest", "reviews_no_translations": False} if "reviews" in fields else {}
+    try:
+        resp = gmaps.place(place_id=place_id, fields=fields, language=language, **kwargs)
+    except TypeError:
+        resp = gmaps.place(place_id=place_id, fields=fields, language=language)
+    result = resp.get("result", {}) if resp else {}
+    if not result:
+        return {}
+    out = {}
+    for t in tiers:
+        keys = [_RESPONSE_KEYS.get(f, f) for f in DETAILS_TIERS[t]]
+        out[t] = {k: result[k] for k in keys if k in result}
+    return out
+
+def _cached(place_ids: list[str], language: str, tiers: list[str]) -> dict:
+    """{place_id: {nivel: campos}} con los niveles que ya están en caché."""
+    keys = {_key(pid, language, t): (pid, t) for pid in place_ids for t in tiers}
+    out = {}
+    for k, v in DETAILS_CACHE.get_many(keys).items():
+        pid, t = keys[k]
+        out.setdefault(pid, {})[t] = v
+    return out
+
+def _merge(groups: dict) -> dict:
+    merged = {}
+    for t in TIER_ORDER:
+        merged.update(groups.get(t) or {})
+    return merged
+
+def _store(place_id: str, language: str, fetched: dict):
+    DETAILS_CACHE.set_many({_key(place_id, language, t): v for t, v in fetched.items()})
+
+def peek_details(place_ids, language: str = "es", tier: str = "basic") -> dict:
+    """{place_id: ficha} de los lugares que ya tienen en caché todos los niveles hasta `tier`.
+    Nunca llama a Google."""
+    tiers = _tiers_upto(tier)
+    place_ids = [str(p) for p in dict.fromkeys(place_ids) if p]
+    return {
+        pid: _merge(groups)
+        for pid, groups in _cached(place_ids, language, tiers).items()
+        if len(groups) == len(tiers)
+    }
+
+def get_details(place_id: str, language: str = "es", tier: str = "rich") -> dict:
+    """Ficha de un lugar con los campos de los niveles hasta `tier`. Los niveles que no están en
+    caché se piden juntos a Details (solo sus campos) y se guardan por separado. {} si falla."""
+    tiers = _tiers_upto(tier)
+    if not place_id:
+        return {}
+    pid = str(place_id)
+    groups = _cached([pid], language, tiers).get(pid, {})
+    missing = [t for t in tiers if t not in groups]
+    if missing:
+        fetched = run_concurrent([lambda: _fetch_details(pid, language, missing)], bucket="places")[0]
+        if fetched:
+            _store(pid, language, fetched)
+            groups.update(fetched)
+    return _merge(groups)
+
+def _prefetch_one(place_id: str, language: str, tier: str):
+    try:
+        tiers = _tiers_upto(tier)
+        groups = _cached([place_id], language, tiers).get(place_id, {})
+        missing = [t for t in tiers if t not in groups]
+        if missing:
+            fetched = _fetch_details(place_id, language, missing)
+            if fetched:
+                _store(place_id, language, fetched)
+    finally:
+        with _inflight_lock:
+            _inflight.discard((language, tier, place_id))
+
+def prefetch_details(place_ids, language: str = "es", tier: str = "basic") -> int:
+    """Pide en segundo plano los niveles hasta `tier` que falten de `place_ids` (en orden) sin superar
+    DETAILS_PREFETCH_MAX_INFLIGHT peticiones a la vez. No espera; devuelve cuántas ha encolado."""
+    place_ids = [str(p) for p in dict.fromkeys(place_ids) if p]
+    cached = peek_details(place_ids, language, tier)
+    queued = 0
+    for pid in place_ids:
+        if pid in cached:
+            continue
+        key = (language, tier, pid)
+        with _inflight_lock:
+            if key in _inflight:
+                continue
+            if len(_inflight) >= DETAILS_PREFETCH_MAX_INFLIGHT:
+                break
+            _inflight.add(key)
+        run_background(lambda pid=pid: _prefetch_one(pid, language, tier), bucket="places")
+        queued += 1
+    return queued
+
+def details_cache_stats() -> dict:
+    return DETAILS_CACHE.stats()
@@ -0,0 +1,149 @@
+import atexit
+import json
+import os
+import sqlite3
+import threading
+import time
+
+class DiskCache:
+    """Caché clave→JSON en un fichero SQLite, compartida entre procesos y réplicas que vean el fichero.
+
+    Las entradas caducan a los `ttl_s` segundos y, por encima de `max_entries`, se expulsan las menos
+    usadas recientemente (LRU). Los aciertos y fallos se acumulan en la propia base de datos.
+
+    Las lecturas no escriben: el último acceso y los contadores se juntan en memoria y se vuelcan
+    cada `FLUSH_EVERY` lecturas o `FLUSH_S` segundos. La caducidad y el LRU se aplican cada
+    `EVICT_EVERY` claves escritas, así que entre medias la tabla puede pasarse un poco de `max_entries`.
+    """
+
+    FLUSH_EVERY = 200
+    FLUSH_S = 30.0
+    EVICT_EVERY = 100
+
+    def __init__(self, path: str, ttl_s: float, max_entries: int):
+        self.path = path
+        self.ttl_s = float(ttl_s)
+        self.max_entries = int(max_entries)
+        self._lock = threading.Lock()
+        self._accessed = {}          # clave → último acceso pendiente de volcar
+        self._hits = self._misses = 0
+        self._reads = 0
+        self._flushed_at = time.time()
+        self._writes = self.EVICT_EVERY  # la primera escritura del proceso ya expulsa
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        with self._connect() as con:
+            con.execute("PRAGMA journal_mode=WAL")
+            con.execute(
+                "CREATE TABLE IF NOT EXISTS entries ("
+                " key TEXT PRIMARY KEY, value TEXT NOT NULL, created REAL NOT NULL, accessed REAL NOT NULL)"
+            )
+            con.execute("CREATE INDEX IF NOT EXISTS entries_accessed ON entries (accessed)")
+            con.execute("CREATE INDEX IF NOT EXISTS entries_created ON entries (created)")
+            con.execute("CREATE TABLE IF NOT EXISTS stats (name TEXT PRIMARY KEY, value INTEGER NOT NULL)")
+            con.execute("INSERT OR IGNORE INTO stats VALUES ('hits', 0), ('misses', 0)")
+        atexit.register(self.flush)
+
+    def _connect(self):
+        return sqlite3.connect(self.path, timeout=10)
+
+    def get_many(self, keys) -> dict:
+        """Devuelve {clave: valor} con las claves vigentes encontradas."""
+        keys = list(dict.fromkeys(keys))
+        if not keys:
+            return {}
+        now = time.time()
+        found = {}
+        try:
+            with self._connect() as con:
+                for i in range(0, len(keys), 500):
+                    chunk = keys[i:i + 500]
+                    marks = ",".join("?" * len(chunk))
+                    rows = con.execute(
+                        f"SELECT key, value FROM entries WHERE key IN ({marks}) AND created >= ?",
+                        (*chunk, now - self.ttl_s),
+                    ).fetchall()
+                    for k, v in rows:
+                        found[k] = json.loads(v)
+        except sqlite3.Error:
+            return {}
+        with self._lock:
+            self._accessed.update(dict.fromkeys(found, now))
+            self._hits += len(found)
+            self._misses += len(keys) - len(found)
+            self._reads += 1
+            due = self._reads >= self.FLUSH_EVERY or now - self._flushed_at >= self.FLUSH_S
+        if due:
+            self.flush()
+        return found
+
+    def flush(self):
+        """Vuelca a la base de datos los accesos y contadores acumulados en memoria."""
+        with self._lock:
+            accessed, hits, misses = self._accessed, self._hits, self._misses
+            self._accessed, self._hits, self._misses = {}, 0, 0
+            self._reads = 0
+            self._flushed_at = time.time()
+        if not (accessed or hits or misses):
+            return
+        try:
+            with self._connect() as con:
+                if accessed:
+                    con.executemany(
+                        "UPDATE entries SET accessed = MAX(accessed, ?) WHERE key = ?",
+                        [(t, k) for k, t in accessed.items()],
+                    )
+                con.execute("UPDATE stats SET value = value + ? WHERE name = 'hits'", (hits,))
+                con.execute("UPDATE stats SET value = value + ? WHERE name = 'misses'", (misses,))
+        except sqlite3.Error:
+            pass
+
+    def get(self, key: str, default=None):
+        return self.get_many([key]).get(key, default)
+
+    def set_many(self, items: dict):
+        if not items:
+            return
+        now = time.time()
+        with self._lock:
+            self._writes += len(items)
+            evict = self._writes >= self.EVICT_EVERY
+            if evict:
+                self._writes = 0
+        try:
+            with self._connect() as con:
+                con.executemany(
+                    "INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?)",
+                    [(k, json.dumps(v), now, now) for k, v in items.items()],
+                )
+                if evict:
+                    self._evict(con, now)
+        except sqlite3.Error:
+            pass
+
+    def _evict(self, con, now: float):
+        con.execute("DELETE FROM entries WHERE created < ?", (now - self.ttl_s,))
+        extra = con.execute("SELECT COUNT(*) FROM entries").fetchone()[0] - self.max_entries
+        if extra > 0:
+            con.execute(
+                "DELETE FROM entries WHERE key IN (SELECT key FROM entries ORDER BY accessed LIMIT ?)",
+                (extra,),
+            )
+
+    def set(self, key: str, value):
+        self.set_many({key: value})
+
+    def stats(self) -> dict:
+        self.flush()
+        try:
+            with self._connect() as con:
+                counters = dict(con.execute("SELECT name, value FROM stats").fetchall())
+                entries = con.execute("SELECT COUNT(*) FROM entries").fetchone()[0]
+        except sqlite3.Error:
+            return {"hits": 0, "misses": 0, "entries": 0, "hit_rate": 0.0}
+        hits, misses = counters.get("hits", 0), counters.get("misses", 0)
+        return {
+            "hits": hits,
+            "misses": misses,
+            "entries": entries,
+            "hit_rate": hits / (hits + misses) if (hits + misses) else 0.0,
+        }
@@ -0,0 +1,133 @@
+import os
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+from config import (
+    gmaps, CACHE_DIR, HOURS_CACHE_TTL_S, HOURS_CACHE_MAX_ENTRIES, OPEN_NOW_SNAPSHOT_MAX_AGE_S
+)
+from concurrency import run_concurrent, run_background
+from disk_cache import DiskCache
+
+# Horarios por place_id: periodos de Details y la última foto de open_now vista en Nearby
+HOURS_CACHE = DiskCache(os.path.join(CACHE_DIR, "hours.sqlite"), HOURS_CACHE_TTL_S, HOURS_CACHE_MAX_ENTRIES)
+
+_MIN_PER_WEEK = 7 * 24 * 60
+
+def _minute_of_week(day: int, hhmm: str) -> int:
+    """Minuto de la semana con el convenio de Google (día 0 = domingo)."""
+    return day * 1440 + int(hhmm[:2]) * 60 + int(hhmm[2:4])
+
+def is_open_at(periods: list, when: datetime) -> bool:
+    """True si los `periods` de opening_hours de Google incluyen `when` (hora local del lugar)."""
+    t = _minute_of_week((when.weekday() + 1) % 7, when.strftime("%H%M"))
+    for p in periods or []:
+        o = p.get("open") or {}
+        c = p.get("close")
+        if "day" not in o:
+            continue
+        if c is None:
+            return True  # abierto 24/7: un único periodo sin cierre
+        start = _minute_of_week(o["day"], o.get("time", "0000"))
+        end = _minute_of_week(c["day"], c.get("time", "0000"))
+        if end <= start:
+            end += _MIN_PER_WEEK
+        if start <= t < end or start <= t + _MIN_PER_WEEK < end:
+            return True
+    return False
+
+def _local_time(entry: dict, when: datetime | None) -> datetime:
+    """Hora local del lugar: las fechas con zona se pasan a su utc_offset; las ingenuas se toman tal cual."""
+    offset = entry.get("utc_offset")
+    if when is None:
+        if offset is None:
+            return datetime.now()
+        when = datetime.now(timezone.utc)
+    if when.tzinfo is not None and offset is not None:
+        return (when.astimezone(timezone.utc) + timedelta(minutes=offset)).replace(tzinfo=None)
+    return when.replace(tzinfo=None)
+
+def record_open_snapshots(results: list):
+    """Guarda el open_now que trae cada resultado de Nearby (válido solo para "ahora")."""
+    seen = {}
+    for p in results:
+        pid = p.get("place_id")
+        flag = (p.get("opening_hours") or {}).get("open_now")
+        if pid and flag is not None:
+            seen[pid] = bool(flag)
+    if not seen:
+        return
+    now = time.time()
+    entries = HOURS_CACHE.get_many(seen)
+    HOURS_CACHE.set_many({
+        pid: {**entries.get(pid, {}), "open_now": flag, "seen_at": now}
+        for pid, flag in seen.items()
+    })
+
+def _fetch_hours(place_id: str, language: str):
+    res = gmaps.place(place_id=place_id, fields=["opening_hours", "utc_offset"], language=language).get("result", {})
+    return {
+        "periods": (res.get("opening_hours") or {}).get("periods") or [],
+        "utc_offset": res.get("utc_offset"),
+        "hours_at": time.time(),
+    }
+
+def _evaluate(entry: dict, when: datetime | None, now: float):
+    if when is None and entry.get("seen_at") and now - entry["seen_at"] < OPEN_NOW_SNAPSHOT_MAX_AGE_S:
+        return entry.get("open_now")
+    if entry.get("periods") and now - entry.get("hours_at", 0) < HOURS_CACHE_TTL_S:
+        return is_open_at(entry["periods"], _local_time(entry, when))
+    return None
+
+def open_status(place_ids, when: datetime | None = None, fetch: bool = True, language: str = "es") -> dict:
+    """{place_id: True/False/None} para `when` (None = ahora). Usa la foto reciente de Nearby o los
+    periodos guardados; con `fetch`, pide a Details (en paralelo) los horarios que falten."""
+    place_ids = [str(p) for p in dict.fromkeys(place_ids) if p]
+    entries = HOURS_CACHE.get_many(place_ids)
+    now = time.time()
+    out = {pid: _evaluate(entries.get(pid, {}), when, now) for pid in place_ids}
+
+    missing = [
+        pid for pid, v in out.items()
+        if v is None and now - entries.get(pid, {}).get("hours_at", 0) >= HOURS_CACHE_TTL_S
+    ]
+    if fetch and missing:
+        fetched = run_concurrent([lambda pid=pid: _fetch_hours(pid, language) for pid in missing], bucket="places")
+        updates = {pid: {**entries.get(pid, {}), **hours} for pid, hours in zip(missing, fetched) if hours}
+        HOURS_CACHE.set_many(updates)
+        for pid, entry in updates.items():
+            out[pid] = _evaluate(entry, when, now)
+    return out
+
+# Horarios pedidos en segundo plano y aún sin respuesta (evita repetirlos entre reruns)
+_inflight = set()
+_inflight_lock = threading.Lock()
+
+def _prefetch_one(place_id: str, language: str):
+    try:
+        hours = _fetch_hours(place_id, language)
+        entry = HOURS_CACHE.get(place_id, {})
+        HOURS_CACHE.set(place_id, {**entry, **hours})
+    finally:
+        with _inflight_lock:
+            _inflight.discard(place_id)
+
+def prefetch_hours(place_ids, language: str = "es") -> int:
+    """Pide en segundo plano a Details los horarios que falten de `place_ids`, sin esperar.
+    Devuelve cuántos ha encolado; open_status los usará en cuanto estén en caché."""
+    place_ids = [str(p) for p in dict.fromkeys(place_ids) if p]
+    entries = HOURS_CACHE.get_many(place_ids)
+    now = time.time()
+    queued = 0
+    for pid in place_ids:
+        if now - entries.get(pid, {}).get("hours_at", 0) < HOURS_CACHE_TTL_S:
+            continue
+        with _inflight_lock:
+            if pid in _inflight:
+                continue
+            _inflight.add(pid)
+        run_background(lambda pid=pid: _prefetch_one(pid, language), bucket="places")
+        queued += 1
+    return queued
+
+def hours_cache_stats() -> dict:
+    return HOURS_CACHE.stats()
@@ -0,0 +1,94 @@
+import math
+import re
+import threading
+import time
+from collections import Counter, OrderedDict
+from config import LLM_CACHE_MAX_ENTRIES, LLM_CACHE_TTL_S, LLM_CACHE_SIMILARITY
+from taxonomy import _norm
+
+def _normalize(text: str) -> str:
+    return re.sub(r"\s+", " ", re.sub(r"[^\w\s]", " ", _norm(text))).strip()
+
+def char_ngrams(text: str, n: int = 3) -> Counter:
+    """Trigramas de caracteres del texto ya normalizado (con espacio de relleno en los bordes)."""
+    padded = f" {text} "
+    return Counter(padded[i:i + n] for i in range(max(1, len(padded) - n + 1)))
+
+def _cosine(a: Counter, a_norm: float, b: Counter, b_norm: float) -> float:
+    if not a_norm or not b_norm:
+        return 0.0
+    if len(a) > len(b):
+        a, b = b, a
+    return sum(v * b.get(k, 0) for k, v in a.items()) / (a_norm * b_norm)
+
+class LLMCache:
+    """Caché de respuestas del LLM por (categoría, conjunto de evitados) con coincidencia aproximada.
+
+    Dentro de un mismo grupo, un texto reutiliza la respuesta de otro si la similitud coseno de sus
+    trigramas de caracteres llega a `threshold`. Expulsión LRU por encima de `max_entries` y
+    caducidad a los `ttl_s` segundos. Segura entre hilos.
+    """
+
+    def __init__(self, max_entries: int = LLM_CACHE_MAX_ENTRIES, ttl_s: float = LLM_CACHE_TTL_S,
+                 threshold: float = LLM_CACHE_SIMILARITY):
+        self.max_entries = int(max_entries)
+        self.ttl_s = float(ttl_s)
+        self.threshold = float(threshold)
+        self.entries = OrderedDict()  # (grupo, texto normalizado) -> (vector, norma, valor, creado)
+        self.lock = threading.Lock()
+        self.hits = self.near_hits = self.misses = 0
+
+    @staticmethod
+    def _group(category: str, avoid) -> tuple:
+        return (category or "neutro", tuple(sorted({a.lower() for a in (avoid or [])})))
+
+    def get(self, text: str, category: str, avoid=None):
+        """Valor guardado para `text` o para un texto parecido del mismo grupo; None si no hay."""
+        group, norm_text = self._group(category, avoid), _normalize(text)
+        now = time.time()
+        with self.lock:
+            exact = self.entries.get((group, norm_text))
+            if exact is not None and now - exact[3] < self.ttl_s:
+                self.entries.move_to_end((group, norm_text))
+                self.hits += 1
+                return exact[2]
+            vec = char_ngrams(norm_text)
+            vnorm = math.sqrt(sum(v * v for v in vec.values()))
+            best, best_sim = None, self.threshold
+            for key, (v, n, _, created) in self.entries.items():
+                if key[0] != group or now - created >= self.ttl_s:
+                    continue
+                sim = _cosine(vec, vnorm, v, n)
+                if sim >= best_sim:
+                    best, best_sim = key, sim
+            if best is None:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(best)
+            self.hits += 1
+            self.near_hits += 1
+            return self.entries[best][2]
+
+    def put(self, text: str, category: str, avoid, value):
+        group, norm_text = self._group(category, avoid), _normalize(text)
+        vec = char_ngrams(norm_text)
+        vnorm = math.sqrt(sum(v * v for v in vec.values()))
+        now = time.time()
+        with self.lock:
+            self.entries[(group, norm_text)] = (vec, vnorm, value, now)
+            self.entries.move_to_end((group, norm_text))
+            for key in [k for k, e in self.entries.items() if now - e[3] >= self.ttl_s]:
+                del self.entries[key]
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def stats(self) -> dict:
+        with self.lock:
+            total = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "near_hits": self.near_hits,
+                "misses": self.misses,
+                "entries": len(self.entries),
+                "hit_rate": self.hits / total if total else 0.0,
+            }
@@ -1,6 +1,6 @@
-import streamlit as st
 from urllib.parse import quote_plus
 from config import gmaps, GOOGLE_MAPS_API_KEY
+from details import get_details
 
 def _maps_link(lat, lon):
     return f"https://www.google.com/maps/search/?api=1&query={lat},{lon}"
@@ -61,29 +61,9 @@ def gm_embed_place_url(place_id=None, latlon=None):
         return f"{base}?key={GOOGLE_MAPS_API_KEY}&q={latlon[0]:.6f},{latlon[1]:.6f}"
     raise ValueError("Debes pasar place_id o latlon.")
 
-@st.cache_data(ttl=600, show_spinner=False)
-def get_place_details(place_id: str, language: str = "es") -> dict:
-    try:
-        fields = [
-            "name", "rating", "user_ratings_total", "url", "googleMapsUri",
-            "reviews", "photos", "editorial_summary"
-        ]
-        try:
-            resp = gmaps.place(
-                place_id=place_id,
-                fields=fields,
-                language=language,
-                reviews_sort="newest",
-                reviews_no_translations=False
-            )
-        except TypeError:
-            resp = gmaps.place(place_id=place_id, fields=fields, language=language)
-        result = resp.get("result", {}) if resp else {}
-        if "url" not in result and "googleMapsUri" in result:
-            result["url"] = result.get("googleMapsUri")
-        return result
-    except Exception:
-        return {}
+def get_place_details(place_id: str, language: str = "es", tier: str = "rich") -> dict:
+    """Ficha de Place Details hasta el nivel `tier` ("basic" o "rich"; caché compartida en disco, ver details.py)."""
+    return get_details(place_id, language, tier)
 
 def place_photo_url(photo_reference: str, maxwidth: int = 640) -> str:
     base = "https://maps.googleapis.com/maps/api/place/photo"
@@ -0,0 +1,215 @@
+import argparse
+import json
+import os
+import re
+import threading
+import zipfile
+import zlib
+import numpy as np
+from config import MOOD_MODEL_PATH
+from taxonomy import CURATED_BY_CATEGORY, CANON_BY_EMOTION, CANON_KEYWORDS, _canon_lookup, _norm
+
+# Trigramas hash: 2^14 columnas y n-gramas de 2 a 4 caracteres
+N_FEATURES = 1 << 14
+NGRAM_RANGE = (2, 4)
+
+# Textos semilla de "neutro" (el resto de categorías salen de MOOD_RULES y del curado)
+NEUTRAL_SEEDS = ["hola", "normal", "nada especial", "no se", "bien sin mas", "un dia cualquiera", "regular"]
+
+def _clean(text: str) -> str:
+    return re.sub(r"\s+", " ", re.sub(r"[^\w\s]", " ", _norm(text))).strip()
+
+def featurize(text: str) -> tuple[np.ndarray, np.ndarray]:
+    """(columnas, cuentas) de los n-gramas de caracteres del texto, con hash estable (crc32)."""
+    padded = f" {_clean(text)} "
+    grams = [
+        padded[i:i + n]
+        for n in range(NGRAM_RANGE[0], NGRAM_RANGE[1] + 1)
+        for i in range(len(padded) - n + 1)
+    ]
+    if not grams:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+    cols = np.fromiter((zlib.crc32(g.encode()) % N_FEATURES for g in grams), dtype=np.int64, count=len(grams))
+    uniq, counts = np.unique(cols, return_counts=True)
+    return uniq, counts.astype(np.float32)
+
+def featurize_many(texts) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Matriz dispersa CSR (indptr, columnas, cuentas) de una lista de textos."""
+    indptr, cols, vals = [0], [], []
+    for t in texts:
+        c, v = featurize(t)
+        cols.append(c)
+        vals.append(v)
+        indptr.append(indptr[-1] + len(c))
+    return (
+        np.asarray(indptr, dtype=np.int64),
+        np.concatenate(cols) if cols else np.empty(0, dtype=np.int64),
+        np.concatenate(vals) if vals else np.empty(0, dtype=np.float32),
+    )
+
+def _rule_seed(pattern: str) -> str:
+    """Texto a partir de un patrón de MOOD_RULES: sin \\b y con la primera opción de cada [..]."""
+    return re.sub(r"\[(.)[^\]]*\]", r"\1", pattern.replace(r"\b", ""))
+
+def training_texts(log_path: str | None = None) -> tuple[list[str], list[str]]:
+    """(textos, categorías): raíces de MOOD_RULES, lugares curados por categoría y, si se pasa,
+    un JSONL con {"text", "category"} (por ejemplo, el registro de respuestas de Gemini)."""
+    from brain import MOOD_RULES, MOOD_CATEGORIES
+    texts, labels = [], []
+    for category, pats in MOOD_RULES:
+        for pat in pats:
+            texts.append(_rule_seed(pat))
+            labels.append(category)
+    for category, places in CURATED_BY_CATEGORY.items():
+        for place in places:
+            texts.append(place)
+            labels.append(category)
+    texts.extend(NEUTRAL_SEEDS)
+    labels.extend(["neutro"] * len(NEUTRAL_SEEDS))
+    if log_path and os.path.exists(log_path):
+        known = set(MOOD_CATEGORIES) | {"neutro"}
+        with open(log_path, encoding="utf-8") as fh:
+            for line in fh:
+                try:
+                    rec = json.loads(line)
+                except ValueError:
+                    continue
+                if rec.get("text") and rec.get("category") in known:
+                    texts.append(rec["text"])
+                    labels.append(rec["category"])
+    return texts, labels
+
+def _canon_weights(classes: list[str]) -> tuple[list[str], np.ndarray]:
+    """Peso de cada canon por categoría: CANON_BY_EMOTION más el curado mapeado a canon, normalizado por fila."""
+    canon = list(dict.fromkeys(CANON_KEYWORDS + [c for pool in CANON_BY_EMOTION.values() for c in pool]))
+    pos = {c: j for j, c in enumerate(canon)}
+    w = np.zeros((len(classes), len(canon)), dtype=np.float32)
+    for i, category in enumerate(classes):
+        for c in CANON_BY_EMOTION.get(category, []):
+            w[i, pos[c]] += 1.0
+        for term in CURATED_BY_CATEGORY.get(category, []):
+            c = _canon_lookup(_norm(term))
+            if c in pos:
+                w[i, pos[c]] += 0.5
+    w /= np.maximum(w.sum(axis=1, keepdims=True), 1e-9)
+    return canon, w
+
+class MoodModel:
+    """Naive Bayes multinomial sobre n-gramas de caracteres con hash: probabilidades de categoría
+    y ranking de keywords canónicas. Se guarda en un .npz comprimido."""
+
+    def __init__(self, classes, log_prior, log_prob, canon, canon_weights):
+        self.classes = list(classes)
+        self.log_prior = np.asarray(log_prior, dtype=np.float32)
+        self.log_prob = np.asarray(log_prob, dtype=np.float32)  # (clases, N_FEATURES)
+        self.canon = list(canon)
+        self.canon_weights = np.asarray(canon_weights, dtype=np.float32)  # (clases, canon)
+
+    @classmethod
+    def train(cls, texts: list[str], labels: list[str], alpha: float = 0.5) -> "MoodModel":
+        classes = list(dict.fromkeys(labels))
+        y = np.array([classes.index(l) for l in labels])
+        indptr, cols, vals = featurize_many(texts)
+        rows = np.repeat(np.arange(len(texts)), np.diff(indptr))
+        counts = np.zeros((len(classes), N_FEATURES), dtype=np.float64)
+        np.add.at(counts, (y[rows], cols), vals)
+        smoothed = counts + alpha
+        log_prob = np.log(smoothed / smoothed.sum(axis=1, keepdims=True))
+        # Los n-gramas que no salen en ningún texto de entrenamiento no aportan evidencia: sin esto
+        # favorecerían a las categorías con menos texto (su suavizado pesa más)
+        log_prob[:, counts.sum(axis=0) == 0] = 0.0
+        # Prior uniforme: el número de semillas por categoría no refleja lo frecuente que es
+        log_prior = np.full(len(classes), -np.log(len(classes)))
+        canon, weights = _canon_weights(classes)
+        return cls(classes, log_prior, log_prob, canon, weights)
+
+    def predict_proba(self, text: str) -> dict:
+        """{categoría: probabilidad} de un texto."""
+        return dict(zip(self.classes, self.predict_proba_many([text])[0].tolist()))
+
+    def predict_proba_many(self, texts: list[str]) -> np.ndarray:
+        """Matriz (textos, clases) de probabilidades."""
+        out = np.empty((len(texts), len(self.classes)), dtype=np.float64)
+        for i, t in enumerate(texts):
+            cols, vals = featurize(t)
+            logit = self.log_prior + self.log_prob[:, cols] @ vals
+            logit -= logit.max()
+            p = np.exp(logit)
+            out[i] = p / p.sum()
+        return out
+
+    def rank_canon(self, text: str | None = None, probs: dict | None = None, avoid=None, k: int = 6) -> list[str]:
+        """Keywords canónicas ordenadas por afinidad con el texto (o con `probs` ya calculadas)."""
+        probs = probs if probs is not None else self.predict_proba(text)
+        p = np.array([probs.get(c, 0.0) for c in self.classes], dtype=np.float32)
+        scores = p @ self.canon_weights
+        avoid_set = {a.lower() for a in (avoid or [])}
+        order = np.argsort(-scores, kind="stable")
+        return [self.canon[j] for j in order if scores[j] > 0 and self.canon[j].lower() not in avoid_set][:k]
+
+    def save(self, path: str):
+        """Escribe en un temporal del mismo directorio y lo renombra: otro proceso que cargue `path`
+        a la vez ve el fichero anterior o el nuevo completo, nunca uno a medias."""
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            with open(tmp, "wb") as fh:
+                np.savez_compressed(
+                    fh, classes=np.array(self.classes), log_prior=self.log_prior,
+                    log_prob=self.log_prob.astype(np.float16), canon=np.array(self.canon),
+                    canon_weights=self.canon_weights,
+                )
+            os.replace(tmp, path)
+        finally:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+
+    @classmethod
+    def load(cls, path: str) -> "MoodModel":
+        with np.load(path, allow_pickle=False) as z:
+            return cls(z["classes"].tolist(), z["log_prior"], z["log_prob"].astype(np.float32),
+                       z["canon"].tolist(), z["canon_weights"])
+
+_MODEL = None
+
+def get_model() -> MoodModel:
+    """Modelo del proceso: se carga de MOOD_MODEL_PATH o, si no existe, se entrena con la taxonomía y se guarda."""
+    global _MODEL
+    if _MODEL is None:
+        try:
+            _MODEL = MoodModel.load(MOOD_MODEL_PATH)
+        except (OSError, KeyError, ValueError, EOFError, zipfile.BadZipFile):
+            # Fichero ausente, dañado o de otro formato: se reentrena
+            _MODEL = MoodModel.train(*training_texts())
+            try:
+                _MODEL.save(MOOD_MODEL_PATH)
+            except OSError:
+                pass
+    return _MODEL
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Modelo local de estado de ánimo (naive Bayes sobre n-gramas)")
+    sub = parser.add_subparsers(dest="cmd", required=True)
+    tr = sub.add_parser("train", help="Entrena con la taxonomía y un JSONL opcional de textos etiquetados")
+    tr.add_argument("--log", help='JSONL con {"text": ..., "category": ...}')
+    tr.add_argument("--out", default=MOOD_MODEL_PATH)
+    tr.add_argument("--alpha", type=float, default=0.5)
+    pr = sub.add_parser("predict", help="Categorías y keywords para un texto")
+    pr.add_argument("text")
+    pr.add_argument("--model", default=MOOD_MODEL_PATH)
+    args = parser.parse_args(argv)
+
+    if args.cmd == "train":
+        texts, labels = training_texts(args.log)
+        model = MoodModel.train(texts, labels, alpha=args.alpha)
+        model.save(args.out)
+        print(f"{len(texts)} textos, {len(model.classes)} categorías → {args.out}")
+    else:
+        model = MoodModel.load(args.model)
+        probs = model.predict_proba(args.text)
+        for c, p in sorted(probs.items(), key=lambda kv: -kv[1])[:3]:
+            print(f"{c}: {p:.2f}")
+        print(", ".join(model.rank_canon(probs=probs)))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,204 @@
+import hashlib
+import io
+import os
+import sqlite3
+import threading
+import time
+from config import (
+    gmaps, CACHE_DIR, PHOTO_CACHE_MAX_BYTES, PHOTO_CACHE_TTL_S, PHOTO_CACHE_MAX_ENTRIES,
+    PHOTO_THUMB_WIDTH, PHOTO_POPOVER_WIDTH
+)
+from concurrency import run_concurrent
+from disk_cache import DiskCache
+
+try:
+    from PIL import Image
+except ImportError:  # sin Pillow se guarda la foto tal cual llega para todas las variantes
+    Image = None
+
+# Variantes guardadas por foto: nombre → ancho máximo en píxeles
+PHOTO_VARIANTS = {"thumb": PHOTO_THUMB_WIDTH, "popover": PHOTO_POPOVER_WIDTH}
+
+PHOTO_DIR = os.path.join(CACHE_DIR, "photos")
+# Índice (photo_reference, variante) → fichero; los ficheros se nombran por el sha256 de su contenido
+PHOTO_INDEX = DiskCache(os.path.join(CACHE_DIR, "photos.sqlite"), PHOTO_CACHE_TTL_S, PHOTO_CACHE_MAX_ENTRIES)
+
+# Ficheros guardados (tamaño y último uso) y totales acumulados, en la misma base que el índice:
+# la expulsión y las estadísticas no tienen que recorrer el directorio
+_FILES_DB = os.path.join(CACHE_DIR, "photos.sqlite")
+# El último uso de un fichero se apunta como mucho una vez por este intervalo
+_TOUCH_EVERY_S = 60
+_touched = {}
+
+def _files_db():
+    return sqlite3.connect(_FILES_DB, timeout=10)
+
+with _files_db() as _con:
+    _con.execute("CREATE TABLE IF NOT EXISTS files (digest TEXT PRIMARY KEY, size INTEGER NOT NULL, used REAL NOT NULL)")
+    _con.execute("CREATE INDEX IF NOT EXISTS files_used ON files (used)")
+    _con.execute("CREATE TABLE IF NOT EXISTS totals (name TEXT PRIMARY KEY, value INTEGER NOT NULL)")
+    _con.execute("INSERT OR IGNORE INTO totals VALUES ('bytes', 0), ('files', 0)")
+
+def _totals(con) -> dict:
+    return dict(con.execute("SELECT name, value FROM totals").fetchall())
+
+# Una sola descarga a la vez por photo_reference dentro del proceso
+_ref_locks = {}
+_ref_locks_guard = threading.Lock()
+_evict_lock = threading.Lock()
+
+def _key(photo_reference: str, variant: str) -> str:
+    return f"{variant}|{photo_reference}"
+
+def _path(digest: str) -> str:
+    return os.path.join(PHOTO_DIR, digest[:2], digest)
+
+def _read(digest: str) -> bytes | None:
+    path = _path(digest)
+    try:
+        with open(path, "rb") as fh:
+            data = fh.read()
+    except OSError:
+        return None
+    now = time.time()
+    if now - _touched.get(digest, 0) >= _TOUCH_EVERY_S:
+        _touched[digest] = now
+        try:
+            with _files_db() as con:
+                con.execute("UPDATE files SET used = ? WHERE digest = ?", (now, digest))
+        except sqlite3.Error:
+            pass
+    return data
+
+def _write(data: bytes) -> str:
+    digest = hashlib.sha256(data).hexdigest()
+    path = _path(digest)
+    if not os.path.exists(path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = f"{path}.{threading.get_ident()}.tmp"
+        with open(tmp, "wb") as fh:
+            fh.write(data)
+        os.replace(tmp, path)
+    try:
+        with _files_db() as con:
+            added = con.execute(
+                "INSERT OR IGNORE INTO files VALUES (?, ?, ?)", (digest, len(data), time.time())
+            ).rowcount
+            if added:
+                con.execute("UPDATE totals SET value = value + ? WHERE name = 'bytes'", (len(data),))
+                con.execute("UPDATE totals SET value = value + 1 WHERE name = 'files'")
+    except sqlite3.Error:
+        pass
+    return digest
+
+# Firmas de los formatos que devuelve Place Photo, para cuando no hay Pillow
+_IMAGE_MAGIC = (b"\xff\xd8\xff", b"\x89PNG\r\n\x1a\n", b"GIF87a", b"GIF89a")
+
+def _is_image(data: bytes) -> bool:
+    """True si `data` es una imagen legible (y no, por ejemplo, un cuerpo de error HTML/JSON)."""
+    if not data:
+        return False
+    if Image is None:
+        return data.startswith(_IMAGE_MAGIC) or (data[:4] == b"RIFF" and data[8:12] == b"WEBP")
+    try:
+        with Image.open(io.BytesIO(data)) as img:
+            img.verify()
+        return True
+    except Exception:
+        return False
+
+def _resize(data: bytes, width: int) -> bytes:
+    if Image is None:
+        return data
+    try:
+        with Image.open(io.BytesIO(data)) as img:
+            if img.width <= width:
+                return data
+            img = img.convert("RGB")
+            img.thumbnail((width, width * 4))
+            out = io.BytesIO()
+            img.save(out, format="JPEG", quality=82, optimize=True)
+            return out.getvalue()
+    except Exception:
+        return data
+
+def _fetch_photo(photo_reference: str) -> bytes:
+    chunks = gmaps.places_photo(photo_reference, max_width=max(PHOTO_VARIANTS.values()))
+    return b"".join(c for c in chunks if c)
+
+def _evict():
+    """Borra las fotos usadas hace más tiempo hasta quedar por debajo de PHOTO_CACHE_MAX_BYTES.
+    Solo mira el total acumulado; si no se pasa del límite no toca el disco."""
+    with _evict_lock:
+        try:
+            with _files_db() as con:
+                total = _totals(con).get("bytes", 0)
+                if total <= PHOTO_CACHE_MAX_BYTES:
+                    return
+                # Se baja al 90 % del límite para no expulsar en cada escritura
+                removed = []
+                for digest, size in con.execute("SELECT digest, size FROM files ORDER BY used"):
+                    if total <= 0.9 * PHOTO_CACHE_MAX_BYTES:
+                        break
+                    try:
+                        os.remove(_path(digest))
+                    except FileNotFoundError:
+                        pass
+                    except OSError:
+                        continue
+                    removed.append((digest, size))
+                    total -= size
+                con.executemany("DELETE FROM files WHERE digest = ?", [(d,) for d, _ in removed])
+                con.execute("UPDATE totals SET value = value - ? WHERE name = 'bytes'", (sum(z for _, z in removed),))
+                con.execute("UPDATE totals SET value = value - ? WHERE name = 'files'", (len(removed),))
+        except sqlite3.Error:
+            pass
+
+def _load(photo_reference: str, variant: str) -> bytes | None:
+    # Otro hilo puede haberla guardado mientras se esperaba el cerrojo
+    entry = PHOTO_INDEX.get(_key(photo_reference, variant))
+    data = _read(entry["file"]) if entry else None
+    if data is not None:
+        return data
+    original = run_concurrent([lambda: _fetch_photo(photo_reference)], bucket="places")[0]
+    if not _is_image(original):
+        return None  # no se guarda: la próxima vista lo vuelve a intentar
+    try:
+        stored = {name: _write(_resize(original, width)) for name, width in PHOTO_VARIANTS.items()}
+    except OSError:
+        return _resize(original, PHOTO_VARIANTS[variant])
+    PHOTO_INDEX.set_many({_key(photo_reference, name): {"file": d} for name, d in stored.items()})
+    data = _read(stored[variant])
+    _evict()
+    return data
+
+def photo_bytes(photo_reference: str, variant: str = "popover") -> bytes | None:
+    """Bytes de la foto en la variante pedida. La primera vez se descarga una sola vez de Google,
+    se guardan todas las variantes en disco y después se sirven en local. None si no se puede."""
+    if not photo_reference or variant not in PHOTO_VARIANTS:
+        return None
+    entry = PHOTO_INDEX.get(_key(photo_reference, variant))
+    if entry:
+        data = _read(entry["file"])
+        if data is not None:
+            return data
+
+    with _ref_locks_guard:
+        lock = _ref_locks.setdefault(photo_reference, threading.Lock())
+    try:
+        with lock:
+            return _load(photo_reference, variant)
+    finally:
+        with _ref_locks_guard:
+            _ref_locks.pop(photo_reference, None)
+
+def photo_cache_stats() -> dict:
+    stats = PHOTO_INDEX.stats()
+    try:
+        with _files_db() as con:
+            totals = _totals(con)
+    except sqlite3.Error:
+        totals = {}
+    stats["bytes"] = totals.get("bytes", 0)
+    stats["files"] = totals.get("files", 0)
+    return stats
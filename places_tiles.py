@@ -0,0 +1,188 @@
+import math
+import os
+import time
+from config import (
+    CACHE_DIR, PLACES_CACHE_TTL_S, PLACES_CACHE_MAX_ENTRIES,
+    PLACES_TILE_MAX_AGE_S
+)
+from disk_cache import DiskCache
+
+# Teselas geohash de precisión 6 (~1.2 km × 0.6 km); la mayoría de radios se cubren con pocas
+TILE_PRECISION = 6
+
+PLACES_CACHE = DiskCache(os.path.join(CACHE_DIR, "nearby_tiles.sqlite"), PLACES_CACHE_TTL_S, PLACES_CACHE_MAX_ENTRIES)
+
+_BASE32 = "0123456789bcdefghjkmnpqrstuvwxyz"
+_M_PER_DEG_LAT = 111320.0
+
+def geohash_encode(lat: float, lon: float, precision: int = TILE_PRECISION) -> str:
+    lat_rng, lon_rng = [-90.0, 90.0], [-180.0, 180.0]
+    out, bits, ch, even = [], 0, 0, True
+    while len(out) < precision:
+        rng, val = (lon_rng, lon) if even else (lat_rng, lat)
+        mid = (rng[0] + rng[1]) / 2
+        ch <<= 1
+        if val >= mid:
+            ch |= 1
+            rng[0] = mid
+        else:
+            rng[1] = mid
+        even = not even
+        bits += 1
+        if bits == 5:
+            out.append(_BASE32[ch])
+            bits, ch = 0, 0
+    return "".join(out)
+
+def geohash_bbox(gh: str) -> tuple[float, float, float, float]:
+    """(sur, oeste, norte, este) de una tesela geohash."""
+    lat_rng, lon_rng = [-90.0, 90.0], [-180.0, 180.0]
+    even = True
+    for c in gh:
+        v = _BASE32.index(c)
+        for shift in range(4, -1, -1):
+            rng = lon_rng if even else lat_rng
+            mid = (rng[0] + rng[1]) / 2
+            if (v >> shift) & 1:
+                rng[0] = mid
+            else:
+                rng[1] = mid
+            even = not even
+    return lat_rng[0], lon_rng[0], lat_rng[1], lon_rng[1]
+
+def _tile_size_deg(precision: int) -> tuple[float, float]:
+    lon_bits = (5 * precision + 1) // 2
+    lat_bits = (5 * precision) // 2
+    return 180.0 / (1 << lat_bits), 360.0 / (1 << lon_bits)
+
+def _offset_m(center, lat, lon) -> tuple[float, float]:
+    """Desplazamiento (este, norte) en metros respecto al centro (equirectangular local)."""
+    return (
+        (lon - center[1]) * _M_PER_DEG_LAT * math.cos(math.radians(center[0])),
+        (lat - center[0]) * _M_PER_DEG_LAT,
+    )
+
+def _in_circle(center, radius_m, lat, lon) -> bool:
+    dx, dy = _offset_m(center, lat, lon)
+    return dx * dx + dy * dy <= radius_m * radius_m
+
+def _rect_relation(center, radius_m, bbox) -> str:
+    """'inside' si la tesela cae entera en el círculo, 'partial' si lo corta, 'out' si no lo toca."""
+    s, w, n, e = bbox
+    corners = [(s, w), (s, e), (n, w), (n, e)]
+    if all(_in_circle(center, radius_m, la, lo) for la, lo in corners):
+        return "inside"
+    near_lat = min(max(center[0], s), n)
+    near_lon = min(max(center[1], w), e)
+    return "partial" if _in_circle(center, radius_m, near_lat, near_lon) else "out"
+
+def covering_tiles(center, radius_m: float, precision: int = TILE_PRECISION) -> dict:
+    """{geohash: 'inside'|'partial'} de las teselas que tocan el círculo."""
+    dlat, dlon = _tile_size_deg(precision)
+    r_lat = radius_m / _M_PER_DEG_LAT
+    r_lon = radius_m / (_M_PER_DEG_LAT * max(1e-6, math.cos(math.radians(center[0]))))
+    lat0 = math.floor((center[0] - r_lat + 90.0) / dlat) * dlat - 90.0
+    lon0 = math.floor((center[1] - r_lon + 180.0) / dlon) * dlon - 180.0
+    tiles = {}
+    lat = lat0
+    while lat < center[0] + r_lat:
+        lon = lon0
+        while lon < center[1] + r_lon:
+            gh = geohash_encode(lat + dlat / 2, lon + dlon / 2, precision)
+            rel = _rect_relation(center, radius_m, geohash_bbox(gh))
+            if rel != "out":
+                tiles[gh] = rel
+            lon += dlon
+        lat += dlat
+    return tiles
+
+def _tile_key(keyword: str, language: str, gh: str) -> str:
+    return f"{keyword.strip().lower()}|{language}|{gh}"
+
+def _result_latlon(p):
+    loc = p.get("geometry", {}).get("location", {})
+    return loc.get("lat"), loc.get("lng")
+
+def filter_to_circle(results: list, center, radius_m: float) -> list:
+    out = []
+    for p in results:
+        lat, lon = _result_latlon(p)
+        if lat is not None and lon is not None and _in_circle(center, radius_m, lat, lon):
+            out.append(p)
+    return out
+
+def _entry_covers(entry: dict, gh: str, center, radius_m: float) -> bool:
+    """Una tesela guardada desde una búsqueda circular solo cubre la parte de la tesela dentro de ese
+    círculo. Prueba conservadora y exacta: vale si la tesela entera cae en el círculo guardado (sus
+    4 esquinas, al ser ambos convexos) o si el círculo de la consulta cabe dentro del guardado."""
+    circle = entry.get("circle")
+    if not circle:
+        return True
+    c_center, c_radius = tuple(circle[0]), float(circle[1])
+    s, w, n, e = geohash_bbox(gh)
+    if all(_in_circle(c_center, c_radius, la, lo) for la, lo in ((s, w), (s, e), (n, w), (n, e))):
+        return True
+    dx, dy = _offset_m(c_center, center[0], center[1])
+    return math.hypot(dx, dy) + radius_m <= c_radius
+
+def plan_nearby(location, keyword: str, radius_m: float, language: str = "es", need_complete: bool = True):
+    """Resuelve una búsqueda con las teselas en caché. Devuelve (resultados ya conocidos dentro del
+    círculo, trabajos pendientes). Cada trabajo es un dict con el círculo a pedir a Nearby, las
+    teselas que quedarán cubiertas con su respuesta (solo en la parte dentro de ese círculo).
+    Con need_complete, las teselas guardadas de una paginación cortada cuentan como pendientes.
+    Las teselas de una búsqueda saturada (Nearby llegó a su máximo de resultados) solo guardan
+    los lugares más prominentes de aquel círculo, así que solo valen para radios iguales o mayores."""
+    tiles = covering_tiles(location, radius_m)
+    keys = {gh: _tile_key(keyword, language, gh) for gh in tiles}
+    entries = PLACES_CACHE.get_many(keys.values())
+    now = time.time()
+
+    cached, missing = [], []
+    for gh, key in keys.items():
+        entry = entries.get(key)
+        usable = (
+            entry
+            and (entry.get("complete", True) or not need_complete)
+            and not (entry.get("saturated") and radius_m < float(entry["circle"][1]))
+        )
+        if usable and now - entry["fetched_at"] < PLACES_TILE_MAX_AGE_S and _entry_covers(entry, gh, location, radius_m):
+            cached.extend(entry["results"])
+        else:
+            missing.append(gh)
+    cached = filter_to_circle(cached, location, radius_m)
+
+    if not missing:
+        return cached, []
+    # Un único trabajo por término: el círculo que envuelve las teselas que faltan, o el de la
+    # consulta si ese es menor. Así nunca se pagan más páginas que sin caché.
+    boxes = [geohash_bbox(gh) for gh in missing]
+    s, w = min(b[0] for b in boxes), min(b[1] for b in boxes)
+    n, e = max(b[2] for b in boxes), max(b[3] for b in boxes)
+    c = ((s + n) / 2, (w + e) / 2)
+    dx, dy = _offset_m(c, n, e)
+    r = math.ceil(math.hypot(dx, dy))
+    circle = (c, r) if r < radius_m else (tuple(location), int(radius_m))
+    return cached, [{"center": circle[0], "radius": circle[1], "tiles": missing, "circle": circle}]
+
+def store_nearby(job: dict, keyword: str, language: str, results: list, complete: bool = True,
+                 saturated: bool = False):
+    """Guarda el resultado de un trabajo repartido por las teselas que cubre; `complete` es False si
+    la paginación se cortó antes de agotar el next_page_token y `saturated` es True si Nearby
+    devolvió su máximo de resultados (puede haber más lugares en el círculo que no vinieron)."""
+    now = time.time()
+    by_tile = {gh: [] for gh in job["tiles"]}
+    for p in results:
+        lat, lon = _result_latlon(p)
+        if lat is None or lon is None:
+            continue
+        gh = geohash_encode(lat, lon)
+        if gh in by_tile:
+            by_tile[gh].append(p)
+    PLACES_CACHE.set_many({
+        _tile_key(keyword, language, gh): {"fetched_at": now, "results": res, "circle": job["circle"],
+                                            "complete": complete, "saturated": saturated}
+        for gh, res in by_tile.items()
+    })
+
+def nearby_cache_stats() -> dict:
+    return PLACES_CACHE.stats()
@@ -1,9 +1,13 @@
-import math
+import threading
 import time
+from collections import OrderedDict
 import numpy as np
 import pandas as pd
 import streamlit as st
 from config import gmaps, W_RATING, W_REVIEWS, W_PROX
+from concurrency import iter_concurrent, throttle
+from places_tiles import plan_nearby, store_nearby, filter_to_circle
+from hours import record_open_snapshots
 
 def geocode_address(address: str, language: str = "es", region: str = "es"):
     res = gmaps.geocode(address, language=language, region=region)
@@ -22,43 +26,94 @@ def reverse_geocode(latlon: tuple[float, float], language: str = "es"):
     return f"{latlon[0]:.6f},{latlon[1]:.6f}"
 
 def haversine_m(lat1, lon1, lat2, lon2):
+    """Distancia en metros; acepta escalares o arrays NumPy (con broadcasting)."""
     R = 6371000.0
-    phi1, phi2 = math.radians(lat1), math.radians(lat2)
-    dphi = math.radians(lat2 - lat1)
-    dlmb = math.radians(lon2 - lon1)
-    a = math.sin(dphi / 2) ** 2 + math.cos(phi1) * math.cos(phi2) * math.sin(dlmb / 2) ** 2
-    c = 2 * math.atan2(math.sqrt(a), math.sqrt(1 - a))
+    phi1, phi2 = np.radians(lat1), np.radians(lat2)
+    dphi = np.radians(np.subtract(lat2, lat1))
+    dlmb = np.radians(np.subtract(lon2, lon1))
+    a = np.sin(dphi / 2) ** 2 + np.cos(phi1) * np.cos(phi2) * np.sin(dlmb / 2) ** 2
+    c = 2 * np.arctan2(np.sqrt(a), np.sqrt(1 - a))
     return R * c
 
+# Memo de columnas de score por (versión del conjunto de resultados, centro, radio, pesos)
+SCORE_MEMO_MAX = 32
+SCORE_COLUMNS = ["rating", "user_ratings_total", "distance_m", "rating_score", "reviews_score", "proximity_score", "score"]
+_score_memo = OrderedDict()
+_score_memo_lock = threading.Lock()
+
+def _numeric_col(df: pd.DataFrame, col: str) -> np.ndarray:
+    if col not in df.columns:
+        return np.full(len(df), np.nan)
+    return pd.to_numeric(df[col], errors="coerce").to_numpy(dtype=float)
+
+def score_arrays(lat, lon, rating, reviews, center_latlon, radius_m, w_rating, w_reviews, w_prox) -> dict:
+    """Núcleo vectorizado del score: arrays NumPy de entrada, dict de columnas de salida."""
+    reviews = np.nan_to_num(reviews, nan=0.0)
+    distance = haversine_m(center_latlon[0], center_latlon[1], lat, lon)
+    rating_score = np.clip(np.nan_to_num(rating, nan=0.0) / 5.0, 0, 1)
+    max_reviews = max(1.0, float(reviews.max())) if len(reviews) else 1.0
+    reviews_score = np.clip(np.log1p(reviews) / np.log1p(max_reviews), 0, 1)
+    proximity_score = np.nan_to_num(np.clip(1.0 - distance / float(radius_m), 0, 1), nan=0.0)
+    denom = max(1e-9, (w_rating + w_reviews + w_prox))
+    score = np.clip((w_rating * rating_score + w_reviews * reviews_score + w_prox * proximity_score) / denom, 0, 1)
+    return {
+        "rating": rating, "user_ratings_total": reviews, "distance_m": distance,
+        "rating_score": rating_score, "reviews_score": reviews_score,
+        "proximity_score": proximity_score, "score": score,
+    }
+
 def compute_scores(df: pd.DataFrame, center_latlon: tuple[float, float], radius_m: int,
-                   w_rating: float = W_RATING, w_reviews: float = W_REVIEWS, w_prox: float = W_PROX) -> pd.DataFrame:
+                   w_rating: float = W_RATING, w_reviews: float = W_REVIEWS, w_prox: float = W_PROX,
+                   version=None) -> pd.DataFrame:
+    """Añade distancia y scores. Con `version` (identificador del conjunto de resultados) se
+    reutilizan las columnas ya calculadas para el mismo centro, radio y pesos."""
     if df.empty:
         return df
     df = df.copy()
-    df["rating"] = pd.to_numeric(df.get("rating", np.nan), errors="coerce")
-    df["user_ratings_total"] = pd.to_numeric(df.get("user_ratings_total", 0), errors="coerce").fillna(0)
-
-    c_lat, c_lon = center_latlon
-    def _dist(row):
-        lat, lon = row.get("lat"), row.get("lon")
-        if pd.notna(lat) and pd.notna(lon):
-            return haversine_m(c_lat, c_lon, float(lat), float(lon))
-        return np.nan
-    df["distance_m"] = df.apply(_dist, axis=1)
-
-    df["rating_score"] = (df["rating"].fillna(0) / 5.0).clip(0, 1)
-    max_reviews = max(1.0, float(df["user_ratings_total"].max()))
-    df["reviews_score"] = (np.log1p(df["user_ratings_total"]) / np.log1p(max_reviews)).clip(0, 1)
-    prox = 1.0 - (df["distance_m"] / float(radius_m))
-    df["proximity_score"] = prox.clip(lower=0, upper=1).fillna(0)
-    s = (w_rating * df["rating_score"] + w_reviews * df["reviews_score"] + w_prox * df["proximity_score"])
-    denom = max(1e-9, (w_rating + w_reviews + w_prox))
-    df["score"] = (s / denom).clip(0, 1)
+    key = (version, tuple(center_latlon), int(radius_m), w_rating, w_reviews, w_prox)
+    if version is not None and "place_id" in df.columns:
+        with _score_memo_lock:
+            memo = _score_memo.get(key)
+            if memo is not None:
+                _score_memo.move_to_end(key)
+        if memo is not None and len(memo[0]) == len(df):
+            ids, cols = memo
+            pids = df["place_id"].to_numpy()
+            if np.array_equal(ids, pids):
+                take = slice(None)
+            else:
+                take = pd.Index(ids).get_indexer(pids)
+                if (take < 0).any():
+                    take = None
+            if take is not None:
+                for c in SCORE_COLUMNS:
+                    df[c] = cols[c][take].copy()
+                return df
+
+    cols = score_arrays(
+        _numeric_col(df, "lat"), _numeric_col(df, "lon"),
+        _numeric_col(df, "rating"), _numeric_col(df, "user_ratings_total"),
+        center_latlon, radius_m, w_rating, w_reviews, w_prox
+    )
+    for c in SCORE_COLUMNS:
+        df[c] = cols[c]
+
+    if version is not None and "place_id" in df.columns and df["place_id"].is_unique:
+        with _score_memo_lock:
+            _score_memo[key] = (df["place_id"].to_numpy(), cols)
+            while len(_score_memo) > SCORE_MEMO_MAX:
+                _score_memo.popitem(last=False)
     return df
 
-@st.cache_data(ttl=300)
-def places_nearby_all(location, keyword, radius=1500, open_now=True, language="es"):
-    all_results = []
+# Nearby devuelve como mucho 60 resultados: 3 páginas de 20
+NEARBY_MAX_PAGES = 3
+NEARBY_MAX_RESULTS = 60
+_paging_stats_lock = threading.Lock()
+
+def _nearby_pages(location, keyword, radius=1500, open_now=True, language="es", keep_paging=None):
+    """Páginas de resultados de Nearby según llegan (incluye la espera que exige el next_page_token).
+    Si `keep_paging()` devuelve False se deja de paginar; el generador devuelve las páginas omitidas."""
+    throttle("places")
     page = gmaps.places_nearby(
         location=location,
         keyword=keyword,
@@ -66,14 +121,88 @@ def places_nearby_all(location, keyword, radius=1500, open_now=True, language="e
         open_now=open_now,
         language=language
     )
-    all_results.extend(page.get("results", []))
+    yield page.get("results", [])
     token = page.get("next_page_token")
+    fetched = 1
     while token:
+        if keep_paging is not None and not keep_paging():
+            return NEARBY_MAX_PAGES - fetched
         time.sleep(2)
+        throttle("places")
         page = gmaps.places_nearby(page_token=token, language=language)
-        all_results.extend(page.get("results", []))
+        yield page.get("results", [])
         token = page.get("next_page_token")
-    return all_results
+        fetched += 1
+    return 0
+
+@st.cache_data(ttl=300)
+def places_nearby_all(location, keyword, radius=1500, open_now=True, language="es"):
+    return [p for page in _nearby_pages(location, keyword, radius, open_now, language) for p in page]
+
+def paging_can_stop(seen: list, last_page: list, location, radius, k: int,
+                    w_rating: float = W_RATING, w_reviews: float = W_REVIEWS, w_prox: float = W_PROX) -> bool:
+    """True si es poco probable que un resultado aún no visto entre en el top-k por score.
+
+    Heurística, no una cota: se supone un no visto con rating 5, proximidad 1 y no más reseñas que
+    el menos reseñado de la última página. Nearby ordena por prominencia, que suele ir con el número
+    de reseñas pero no siempre, así que una página posterior puede traer un lugar más reseñado
+    que entraría en el top. Por eso solo se usa en "Búsqueda rápida"."""
+    if not k or len(seen) < k or not last_page:
+        return False
+    num = lambda key: np.array([p.get(key) if p.get(key) is not None else np.nan for p in seen], dtype=float)
+    lat = np.array([p.get("geometry", {}).get("location", {}).get("lat", np.nan) for p in seen], dtype=float)
+    lon = np.array([p.get("geometry", {}).get("location", {}).get("lng", np.nan) for p in seen], dtype=float)
+    cols = score_arrays(lat, lon, num("rating"), num("user_ratings_total"), location, radius, w_rating, w_reviews, w_prox)
+    kth = np.sort(cols["score"])[-k]
+    rev_last = float(min((p.get("user_ratings_total") or 0) for p in last_page))
+    max_rev = max(1.0, float(cols["user_ratings_total"].max()), rev_last)
+    denom = max(1e-9, (w_rating + w_reviews + w_prox))
+    estimate = (w_rating + w_reviews * np.log1p(rev_last) / np.log1p(max_rev) + w_prox) / denom
+    return bool(kth >= estimate)
+
+def _job_pages(job: dict, location, radius, keyword, language, top_k=None, stats=None):
+    """Páginas de un trabajo de teselas (sin open_now), recortadas al círculo pedido. Con `top_k`,
+    deja de paginar cuando las páginas restantes ya no pueden cambiar el top. Al terminar, guarda
+    la respuesta en la caché de teselas y el open_now de cada lugar en la de horarios."""
+    got, seen, last = [], [], []
+    keep = (lambda: not paging_can_stop(seen, last, location, radius, top_k)) if top_k else None
+    pages = _nearby_pages(job["center"], keyword, job["radius"], False, language, keep_paging=keep)
+    fetched, skipped = 0, 0
+    while True:
+        try:
+            page = next(pages)
+        except StopIteration as stop:
+            skipped = stop.value or 0
+            break
+        fetched += 1
+        got.extend(page)
+        last = filter_to_circle(page, location, radius)
+        seen.extend(last)
+        yield last
+    store_nearby(job, keyword, language, got, complete=(skipped == 0), saturated=len(got) >= NEARBY_MAX_RESULTS)
+    record_open_snapshots(got)
+    if stats is not None:
+        with _paging_stats_lock:
+            stats["pages"] = stats.get("pages", 0) + fetched
+            stats["skipped_pages"] = stats.get("skipped_pages", 0) + skipped
+
+def iter_places_nearby(location, terms: list[str], radius=1500, language="es",
+                       top_k: int | None = None, stats: dict | None = None):
+    """Produce (término, resultados) según llegan. Primero lo que ya está en la caché de teselas;
+    después, todas las teselas que faltan de todos los términos en paralelo (las esperas del
+    next_page_token corren a la vez). Se busca siempre sin open_now: "abierto" se evalúa en
+    local con hours.open_status. Con `top_k` la paginación para en cuanto no puede cambiar
+    el top; `stats` acumula páginas pedidas y omitidas."""
+    producers, owners = [], []
+    for term in terms:
+        cached, jobs = plan_nearby(location, term, radius, language, need_complete=top_k is None)
+        if cached:
+            yield term, cached
+        for job in jobs:
+            producers.append(lambda j=job, t=term: _job_pages(j, location, radius, t, language, top_k, stats))
+            owners.append(term)
+    for i, page in iter_concurrent(producers):
+        yield owners[i], page
 
 def filter_by_rating_df(df: pd.DataFrame, min_rating=0.0) -> pd.DataFrame:
     if "rating" not in df.columns:
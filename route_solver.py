@@ -0,0 +1,95 @@
+import numpy as np
+
+# Hasta este número de paradas libres se resuelve exacto (Held-Karp, O(2^n · n^2))
+HELD_KARP_MAX_STOPS = 10
+# Coste que sustituye a tramos sin ruta (NaN) en la matriz
+UNREACHABLE_SECS = 1e9
+
+def path_cost(matrix: np.ndarray, path: list[int]) -> float:
+    """Suma de tramos de un camino de nodos (el 0 es el origen)."""
+    return float(sum(matrix[a, b] for a, b in zip(path, path[1:])))
+
+def _held_karp(m: np.ndarray, free: list[int], end: int | None) -> list[int]:
+    """Orden óptimo de los nodos `free` saliendo de 0 y, si hay `end`, terminando en él."""
+    n = len(free)
+    if n == 0:
+        return []
+    full = (1 << n) - 1
+    w = m[np.ix_(free, free)]                       # tramos entre nodos libres
+    dp = np.full((1 << n, n), np.inf)
+    parent = np.full((1 << n, n), -1, dtype=int)
+    for j in range(n):
+        dp[1 << j, j] = m[0, free[j]]
+    for mask in range(1, full + 1):
+        if mask & (mask - 1) == 0:
+            continue
+        for j in range(n):
+            if not mask & (1 << j):
+                continue
+            prev = mask ^ (1 << j)
+            cand = dp[prev] + w[:, j]
+            i = int(np.argmin(cand))
+            dp[mask, j] = cand[i]
+            parent[mask, j] = i
+    closing = m[free, end] if end is not None else np.zeros(n)
+    j = int(np.argmin(dp[full] + closing))
+    order, mask = [], full
+    while j >= 0:
+        order.append(free[j])
+        mask, j = mask ^ (1 << j), parent[mask, j]
+    return order[::-1]
+
+def _nearest_neighbour(m: np.ndarray, free: list[int]) -> list[int]:
+    left, order, cur = set(free), [], 0
+    while left:
+        cur = min(left, key=lambda k: m[cur, k])
+        order.append(cur)
+        left.discard(cur)
+    return order
+
+def _local_search(m: np.ndarray, order: list[int], end: int | None) -> list[int]:
+    """2-opt + Or-opt (segmentos de 1 a 3) hasta que ninguna jugada mejora. Admite matriz asimétrica."""
+    tail = [end] if end is not None else []
+    best = list(order)
+    best_cost = path_cost(m, [0] + best + tail)
+    improved = True
+    while improved:
+        improved = False
+        n = len(best)
+        # 2-opt: invierte best[i:j]
+        for i in range(n - 1):
+            for j in range(i + 2, n + 1):
+                cand = best[:i] + best[i:j][::-1] + best[j:]
+                cost = path_cost(m, [0] + cand + tail)
+                if cost < best_cost - 1e-9:
+                    best, best_cost, improved = cand, cost, True
+        # Or-opt: mueve un segmento corto a otra posición
+        for seg in (1, 2, 3):
+            for i in range(n - seg + 1):
+                segment = best[i:i + seg]
+                rest = best[:i] + best[i + seg:]
+                for k in range(len(rest) + 1):
+                    if k == i:
+                        continue
+                    cand = rest[:k] + segment + rest[k:]
+                    cost = path_cost(m, [0] + cand + tail)
+                    if cost < best_cost - 1e-9:
+                        best, best_cost, improved = cand, cost, True
+    return best
+
+def solve_stop_order(matrix: np.ndarray, fixed_end: bool = True) -> list[int]:
+    """Orden de visita de las paradas sobre una matriz (n+1)×(n+1) de segundos, nodo 0 = origen.
+    Devuelve índices de parada (0..n-1). Con fixed_end la última parada sigue siendo el destino."""
+    m = np.nan_to_num(np.asarray(matrix, dtype=float), nan=UNREACHABLE_SECS)
+    n = m.shape[0] - 1
+    if n <= 0:
+        return []
+    end = n if fixed_end else None
+    free = list(range(1, n if fixed_end else n + 1))
+    if len(free) <= HELD_KARP_MAX_STOPS:
+        path = _held_karp(m, free, end)
+    else:
+        path = _local_search(m, _nearest_neighbour(m, free), end)
+    if end is not None:
+        path = path + [end]
+    return [node - 1 for node in path]
@@ -1,14 +1,65 @@
+import os
+import re
 import numpy as np
 import pandas as pd
-import streamlit as st
 from datetime import datetime
-from config import gmaps
+from config import gmaps, CACHE_DIR, ROUTE_CACHE_TTL_S, ROUTE_CACHE_MAX_ENTRIES
+from concurrency import run_concurrent
+from disk_cache import DiskCache
+from ranking import haversine_m
+from route_solver import solve_stop_order, path_cost, UNREACHABLE_SECS
+
+# Límites de Distance Matrix por petición
+MATRIX_MAX_SIDE = 25
+MATRIX_MAX_ELEMENTS = 100
+
+# Estimador local: velocidad media (m/s), factor de circuidad y espera fija por tramo (s)
+SPEED_PROFILES = {
+    "driving":   (8.5,  1.40, 60.0),
+    "walking":   (1.35, 1.25, 0.0),
+    "bicycling": (4.2,  1.30, 0.0),
+    "transit":   (5.5,  1.50, 300.0),
+}
+# Un candidato está "claramente mal" si su ratio estimado dividido por este margen sigue por encima de 0.5
+ESTIMATE_SLACK = 1.6
+
+# Caché persistente de rutas: coordenadas cuantizadas (4 decimales ≈ 11 m) y franja de salida
+ROUTE_COORD_DECIMALS = 4
+TRAFFIC_MODES = ("driving", "transit")
+ROUTE_CACHE = DiskCache(os.path.join(CACHE_DIR, "routes.sqlite"), ROUTE_CACHE_TTL_S, ROUTE_CACHE_MAX_ENTRIES)
+
+_LATLON_RE = re.compile(r"^\s*(-?\d+(?:\.\d+)?)\s*,\s*(-?\d+(?:\.\d+)?)\s*$")
 
 def _latlon_str(latlon):
     return f"{latlon[0]},{latlon[1]}"
 
-@st.cache_data(ttl=180, show_spinner=False)
+def _quantize_point(point) -> str:
+    """Clave estable de un punto: coordenadas redondeadas o dirección en minúsculas sin espacios extra."""
+    if isinstance(point, (tuple, list)):
+        point = _latlon_str(point)
+    m = _LATLON_RE.match(str(point))
+    if m:
+        return f"{float(m.group(1)):.{ROUTE_COORD_DECIMALS}f},{float(m.group(2)):.{ROUTE_COORD_DECIMALS}f}"
+    return " ".join(str(point).lower().split())
+
+def _departure_bucket(mode: str, when: datetime | None = None) -> str:
+    """Franja de salida (día de la semana y hora) en los modos sensibles al tráfico; el resto no depende de la hora."""
+    if mode not in TRAFFIC_MODES:
+        return "*"
+    when = when or datetime.now()
+    return f"{when.weekday()}h{when.hour:02d}"
+
+def route_cache_stats() -> dict:
+    return ROUTE_CACHE.stats()
+
 def route_total_seconds(origin_text: str, waypoints: tuple, dest_latlon: tuple, mode: str):
+    key = "route|" + "|".join(
+        [_quantize_point(origin_text)] + [_quantize_point(w) for w in (waypoints or ())]
+        + [_quantize_point(dest_latlon), mode, _departure_bucket(mode)]
+    )
+    cached = ROUTE_CACHE.get(key)
+    if cached is not None:
+        return float(cached)
     try:
         r = gmaps.directions(
             origin_text,
@@ -20,13 +71,16 @@ def route_total_seconds(origin_text: str, waypoints: tuple, dest_latlon: tuple,
         )
         if not r:
             return None
-        secs = sum(leg["duration"]["value"] for leg in r[0]["legs"])
-        return float(secs)
+        secs = float(sum(leg["duration"]["value"] for leg in r[0]["legs"]))
+        ROUTE_CACHE.set(key, secs)
+        return secs
     except Exception:
         return None
 
-@st.cache_data(ttl=180, show_spinner=False)
-def optimize_route_order(origin_text: str, stops_latlon: list[tuple[float, float]], mode: str):
+def optimize_route_order(origin_text: str, stops_latlon: list[tuple[float, float]], mode: str,
+                         fixed_dest: bool = True):
+    """Ordena las paradas en local sobre una matriz de tiempos y solo pide a Directions la ruta final.
+    Devuelve (índices de los waypoints en stops_latlon, waypoints ordenados, destino, segundos)."""
     if not stops_latlon:
         return [], [], None, None
     if len(stops_latlon) == 1:
@@ -34,26 +88,19 @@ def optimize_route_order(origin_text: str, stops_latlon: list[tuple[float, float
         secs = route_total_seconds(origin_text, tuple(), dest, mode)
         return [], [], dest, secs
 
-    dest = stops_latlon[-1]
-    waypoints = stops_latlon[:-1]
-    try:
-        r = gmaps.directions(
-            origin_text,
-            _latlon_str(dest),
-            mode=mode,
-            waypoints=[_latlon_str(wp) for wp in waypoints],
-            optimize_waypoints=True,
-            departure_time=datetime.now()
-        )
-        if not r:
-            return list(range(len(waypoints))), waypoints, dest, None
-        order = r[0].get("waypoint_order", list(range(len(waypoints))))
-        ordered_wp = [waypoints[i] for i in order]
-        secs = sum(leg["duration"]["value"] for leg in r[0]["legs"])
-        return order, ordered_wp, dest, float(secs)
-    except Exception:
-        secs = route_total_seconds(origin_text, tuple(_latlon_str(w) for w in waypoints), dest, mode)
-        return list(range(len(waypoints))), waypoints, dest, secs
+    points = (origin_text,) + tuple(_latlon_str(p) for p in stops_latlon)
+    matrix = travel_time_matrix(points, points, mode)
+    order = solve_stop_order(matrix, fixed_end=fixed_dest)
+
+    dest = stops_latlon[order[-1]]
+    wp_order = order[:-1]
+    ordered_wp = [stops_latlon[i] for i in wp_order]
+    secs = route_total_seconds(origin_text, tuple(_latlon_str(w) for w in ordered_wp), dest, mode)
+    if secs is None:
+        # Sin Directions (p. ej. más waypoints de los permitidos): suma de tramos de la matriz
+        legs = path_cost(matrix, [0] + [i + 1 for i in order])
+        secs = legs if legs < UNREACHABLE_SECS else None
+    return wp_order, ordered_wp, dest, secs
 
 def label_from_ratio(ratio: float | None) -> str:
     if ratio is None or np.isnan(ratio):
@@ -64,50 +111,209 @@ def label_from_ratio(ratio: float | None) -> str:
     if ratio <= 1.00:   return "mal"
     return "muy mal"
 
-def compute_multi_stop_detours(origin_text: str, selected_coords: list[tuple[float,float]], candidates_df, mode: str):
-    if candidates_df.empty or len(selected_coords) == 0:
-        candidates_df["detour_ratio"] = np.nan
-        candidates_df["ruta"] = ""
-        return candidates_df
+def _matrix_blocks(n_orig: int, n_dest: int):
+    """Trocea origen×destino respetando los límites de Distance Matrix por petición."""
+    o_step = min(MATRIX_MAX_SIDE, n_orig)
+    d_step = min(MATRIX_MAX_SIDE, max(1, MATRIX_MAX_ELEMENTS // max(1, o_step)))
+    for o0 in range(0, n_orig, o_step):
+        for d0 in range(0, n_dest, d_step):
+            yield o0, min(o0 + o_step, n_orig), d0, min(d0 + d_step, n_dest)
+
+def travel_time_matrix(origins: tuple, destinations: tuple, mode: str) -> np.ndarray:
+    """Segundos de viaje origen×destino (NaN si no hay ruta). Cada par se guarda en la caché de rutas;
+    solo se pide a Distance Matrix la submatriz que falta, en bloques paralelos con cuota."""
+    out = np.full((len(origins), len(destinations)), np.nan)
+    if not origins or not destinations:
+        return out
+    bucket = _departure_bucket(mode)
+    q_orig = [_quantize_point(o) for o in origins]
+    q_dest = [_quantize_point(d) for d in destinations]
+    keys = [[f"pair|{a}|{b}|{mode}|{bucket}" for b in q_dest] for a in q_orig]
+    cached = ROUTE_CACHE.get_many(k for row in keys for k in row)
+    for i, row in enumerate(keys):
+        for j, k in enumerate(row):
+            if k in cached:
+                out[i, j] = float(cached[k])
 
-    dest = selected_coords[-1]
-    base_waypoints = tuple(_latlon_str(p) for p in selected_coords[:-1])
-    base_secs = route_total_seconds(origin_text, base_waypoints, dest, mode)
-    if not base_secs or base_secs <= 0:
+    miss = np.isnan(out)
+    rows = np.flatnonzero(miss.any(axis=1))
+    cols = np.flatnonzero(miss.any(axis=0))
+    if len(rows) == 0:
+        return out
+    sub_orig = [origins[i] for i in rows]
+    sub_dest = [destinations[j] for j in cols]
+    now = datetime.now()
+    blocks = list(_matrix_blocks(len(sub_orig), len(sub_dest)))
+
+    def _fetch(o0, o1, d0, d1):
+        return lambda: gmaps.distance_matrix(
+            sub_orig[o0:o1],
+            sub_dest[d0:d1],
+            mode=mode,
+            departure_time=now
+        )
+
+    fresh = {}
+    responses = run_concurrent([_fetch(*blk) for blk in blocks], bucket="directions")
+    for (o0, _, d0, _), r in zip(blocks, responses):
+        if not r:
+            continue
+        for i, row in enumerate(r.get("rows", [])):
+            for j, el in enumerate(row.get("elements", [])):
+                if el.get("status") == "OK" and "duration" in el:
+                    oi, dj = rows[o0 + i], cols[d0 + j]
+                    out[oi, dj] = float(el["duration"]["value"])
+                    fresh[keys[oi][dj]] = out[oi, dj]
+    ROUTE_CACHE.set_many(fresh)
+    return out
+
+def estimate_seconds_matrix(a_latlon, b_latlon, mode: str) -> np.ndarray:
+    """Segundos estimados a×b sin API: haversine × circuidad / velocidad + espera por tramo."""
+    a = np.asarray(a_latlon, dtype=float).reshape(-1, 2)
+    b = np.asarray(b_latlon, dtype=float).reshape(-1, 2)
+    speed, circuity, overhead = SPEED_PROFILES.get(mode, SPEED_PROFILES["driving"])
+    dist = haversine_m(a[:, None, 0], a[:, None, 1], b[None, :, 0], b[None, :, 1])
+    return dist * circuity / speed + overhead
+
+def _row_nanmin(extra: np.ndarray) -> np.ndarray:
+    all_nan = np.isnan(extra).all(axis=1)
+    return np.where(all_nan, np.nan, np.nanmin(np.where(all_nan[:, None], 0.0, extra), axis=1))
+
+def _cheapest_insertion(to_cand, from_cand, legs) -> np.ndarray:
+    """Mínimo de t(a,c) + t(c,b) - t(a,b) sobre los huecos de la ruta. to_cand y from_cand son (N, K)."""
+    return _row_nanmin(to_cand + from_cand - legs[None, :])
+
+def estimate_detour_ratios(origin_latlon, selected_coords, cand_latlon, mode: str) -> np.ndarray:
+    route = np.asarray([origin_latlon] + list(selected_coords), dtype=float)
+    cand = np.asarray(cand_latlon, dtype=float).reshape(-1, 2)
+    legs = estimate_seconds_matrix(route[:-1], route[1:], mode).diagonal()
+    base_secs = float(np.sum(legs))
+    if base_secs <= 0:
+        return np.full(len(cand), np.nan)
+    to_cand = estimate_seconds_matrix(route[:-1], cand, mode).T
+    from_cand = estimate_seconds_matrix(cand, route[1:], mode)
+    return np.maximum(0.0, _cheapest_insertion(to_cand, from_cand, legs) / base_secs)
+
+class DetourState:
+    """Costes de inserción por candidato para una selección ordenada.
+
+    Guarda por punto de ruta los vectores punto→candidato y candidato→punto, los tramos base y el
+    coste de inserción de cada hueco. Al añadir o quitar una parada solo se piden los vectores del
+    punto nuevo y los tramos que cambian; el resto es un mínimo O(candidatos × huecos) en local.
+    """
+
+    def __init__(self, origin_text: str, mode: str, candidates_df: pd.DataFrame):
+        self.origin_text = origin_text
+        self.mode = mode
+        self.ids = tuple(str(x) for x in candidates_df["place_id"])
+        self.pos = {pid: i for i, pid in enumerate(self.ids)}
+        lat = pd.to_numeric(candidates_df["lat"], errors="coerce").to_numpy(dtype=float)
+        lon = pd.to_numeric(candidates_df["lon"], errors="coerce").to_numpy(dtype=float)
+        self.valid = ~(np.isnan(lat) | np.isnan(lon))
+        self.cand_pts = tuple(_latlon_str(p) if ok else "" for p, ok in zip(zip(lat, lon), self.valid))
+        n = len(self.ids)
+        self.to_cand = {}    # punto -> (N,) segundos punto→candidato
+        self.from_cand = {}  # punto -> (N,) segundos candidato→punto
+        self.fetched = {}    # punto -> (N,) bool, columnas ya obtenidas (los fallos se vuelven a pedir)
+        self.legs = {}       # (a, b) -> segundos
+        self.slots = {}      # (a, b) -> (N,) coste de insertar cada candidato entre a y b
+        self.stops = ()
+        self.ratios = np.full(n, np.nan)
+
+    def matches(self, origin_text: str, mode: str, candidates_df: pd.DataFrame) -> bool:
+        if origin_text != self.origin_text or mode != self.mode or "place_id" not in candidates_df.columns:
+            return False
+        return all(str(pid) in self.pos for pid in candidates_df["place_id"])
+
+    def columns(self, candidates_df: pd.DataFrame) -> np.ndarray:
+        return np.array([self.pos[str(pid)] for pid in candidates_df["place_id"]], dtype=int)
+
+    def _fill(self, points: list[str], need: np.ndarray) -> set:
+        """Pide en bloque las columnas de `need` que aún faltan para `points`; devuelve los puntos tocados."""
+        n = len(self.ids)
+        for p in points:
+            if p not in self.fetched:
+                self.to_cand[p] = np.full(n, np.nan)
+                self.from_cand[p] = np.full(n, np.nan)
+                self.fetched[p] = np.zeros(n, dtype=bool)
+        missing = {p: need & ~self.fetched[p] for p in points}
+        todo = [p for p in points if missing[p].any()]
+        if not todo:
+            return set()
+        cols = np.flatnonzero(np.logical_or.reduce([missing[p] for p in todo]))
+        cand_pts = tuple(self.cand_pts[i] for i in cols)
+        to_m = travel_time_matrix(tuple(todo), cand_pts, self.mode)
+        from_m = travel_time_matrix(cand_pts, tuple(todo), self.mode)
+        for j, p in enumerate(todo):
+            self.to_cand[p][cols] = to_m[j]
+            self.from_cand[p][cols] = from_m[:, j]
+            # Un bloque que falla o vence su plazo llega como NaN: no se da por pedido
+            self.fetched[p][cols] = np.isfinite(to_m[j]) & np.isfinite(from_m[:, j])
+        return set(todo)
+
+    def update(self, selected_coords: list[tuple[float, float]], need: np.ndarray | None = None) -> np.ndarray:
+        """Ratios de desvío (N,) para la selección dada, calculando solo lo que ha cambiado."""
+        need = self.valid.copy() if need is None else (need & self.valid)
+        stops = tuple(_latlon_str(p) for p in selected_coords)
+        route = (self.origin_text,) + stops
+        edges = list(zip(route[:-1], route[1:]))
+
+        touched = self._fill(list(dict.fromkeys(route)), need)
+
+        new_edges = [e for e in edges if e not in self.legs]
+        if new_edges:
+            m = travel_time_matrix(tuple(a for a, _ in new_edges), tuple(b for _, b in new_edges), self.mode)
+            for i, e in enumerate(new_edges):
+                if np.isfinite(m[i, i]):  # los tramos que fallan se vuelven a pedir en la próxima llamada
+                    self.legs[e] = m[i, i]
+        fresh = set(new_edges)
+
+        for a, b in edges:
+            if (a, b) not in self.slots or a in touched or b in touched or (a, b) in fresh:
+                self.slots[(a, b)] = self.to_cand[a] + self.from_cand[b] - self.legs.get((a, b), np.nan)
+        self.stops = stops
+
+        base_secs = float(np.sum([self.legs.get(e, np.nan) for e in edges]))
+        if np.isnan(base_secs) or base_secs <= 0:
+            self.ratios = np.full(len(self.ids), np.nan)
+            return self.ratios
+        best = _row_nanmin(np.column_stack([self.slots[e] for e in edges]))
+        self.ratios = np.where(need, np.maximum(0.0, best / base_secs), np.nan)
+        return self.ratios
+
+def compute_multi_stop_detours(origin_text: str, selected_coords: list[tuple[float,float]], candidates_df, mode: str,
+                               origin_latlon: tuple[float, float] | None = None, fast: bool = False,
+                               state: DetourState | None = None):
+    """Etiqueta el desvío de cada candidato. Con origin_latlon, los candidatos claramente "mal"/"muy mal"
+    se resuelven con el estimador local; con fast=True no se llama a la API. Si se pasa un `state`
+    compatible (mismo origen, modo y candidatos), se reutiliza lo ya calculado."""
+    if candidates_df.empty or len(selected_coords) == 0:
         candidates_df["detour_ratio"] = np.nan
         candidates_df["ruta"] = ""
         return candidates_df
 
-    many_paradas = len(selected_coords) > 6
-    max_insert_positions = 1 if many_paradas else (len(selected_coords))
+    if state is None or not state.matches(origin_text, mode, candidates_df):
+        state = DetourState(origin_text, mode, candidates_df)
+    cols = state.columns(candidates_df)
+    valid = state.valid[cols]
 
-    ratios = []
-    for _, row in candidates_df.iterrows():
-        lat, lon = row.get("lat"), row.get("lon")
-        if pd.isna(lat) or pd.isna(lon):
-            ratios.append(np.nan)
-            continue
-        cand = (float(lat), float(lon))
-        best_secs = None
-
-        if max_insert_positions == 1:
-            new_wp = list(base_waypoints) + [_latlon_str(cand)]
-            secs = route_total_seconds(origin_text, tuple(new_wp), dest, mode)
-            best_secs = secs
-        else:
-            for i in range(max_insert_positions + 1):
-                new_wp = list(base_waypoints)
-                new_wp.insert(i, _latlon_str(cand))
-                secs = route_total_seconds(origin_text, tuple(new_wp), dest, mode)
-                if secs:
-                    best_secs = secs if (best_secs is None or secs < best_secs) else best_secs
-
-        if best_secs and best_secs > 0:
-            ratios.append(max(0.0, (best_secs - base_secs) / base_secs))
-        else:
-            ratios.append(np.nan)
+    ratios = np.full(len(candidates_df), np.nan)
+    exact = valid.copy()
+    if origin_latlon is not None:
+        lat = pd.to_numeric(candidates_df["lat"], errors="coerce").to_numpy(dtype=float)
+        lon = pd.to_numeric(candidates_df["lon"], errors="coerce").to_numpy(dtype=float)
+        cand = np.column_stack([lat, lon])
+        est = np.full(len(candidates_df), np.nan)
+        est[valid] = estimate_detour_ratios(origin_latlon, selected_coords, cand[valid], mode)
+        confident = valid & (fast | (est / ESTIMATE_SLACK > 0.50))
+        ratios[confident] = est[confident]
+        exact &= ~confident
+    if exact.any():
+        need = np.zeros(len(state.ids), dtype=bool)
+        need[cols[exact]] = True
+        ratios[exact] = state.update(selected_coords, need)[cols[exact]]
 
     candidates_df = candidates_df.copy()
     candidates_df["detour_ratio"] = ratios
     candidates_df["ruta"] = candidates_df["detour_ratio"].apply(label_from_ratio)
-    return candidates_df
\ No newline at end of file
+    return candidates_df
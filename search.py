@@ -0,0 +1,32 @@
+import pandas as pd
+from config import W_RATING, W_REVIEWS, W_PROX
+from consolidation import results_frame, consolidate, finalize
+from ranking import compute_scores, iter_places_nearby
+
+def _scored_frame(consolidated: pd.DataFrame, terms: list[str], center_latlon, radius, version=None,
+                  sort: bool = True) -> pd.DataFrame:
+    if consolidated.empty:
+        return pd.DataFrame()
+    df = finalize(consolidated, terms)
+    df = compute_scores(df, center_latlon, radius, w_rating=W_RATING, w_reviews=W_REVIEWS, w_prox=W_PROX, version=version)
+    if not sort:
+        return df.reset_index(drop=True)
+    return df.sort_values(by=["score"], ascending=[False]).reset_index(drop=True)
+
+def stream_nearby(terms: list[str], center_latlon, radius, language="es", version=None,
+                  top_k=None, stats=None):
+    """Genera DataFrames consolidados y puntuados a medida que llegan términos y páginas.
+    Los parciales van sin ordenar (la vista previa saca su top con PlaceIndex.top_k); el último
+    es el conjunto completo, puntuado con `version` y ordenado por score.
+    `top_k` y `stats` se pasan a iter_places_nearby (paginación con parada temprana)."""
+    terms = list(dict.fromkeys(terms))
+    term_idx = {t: i for i, t in enumerate(terms)}
+    acc = consolidate([])
+    for term, results in iter_places_nearby(center_latlon, terms, radius=radius, language=language,
+                                            top_k=top_k, stats=stats):
+        if not results:
+            continue
+        # Consolidación incremental: lo acumulado más la página nueva
+        acc = consolidate([acc, results_frame(results, term_idx[term])])
+        yield _scored_frame(acc, terms, center_latlon, radius, sort=False)
+    yield _scored_frame(acc, terms, center_latlon, radius, version=version)
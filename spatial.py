@@ -0,0 +1,75 @@
+import heapq
+import math
+import numpy as np
+import pandas as pd
+from ranking import haversine_m
+
+# Lado de celda de la rejilla en metros
+GRID_CELL_M = 250.0
+_M_PER_DEG_LAT = 111320.0
+
+class PlaceIndex:
+    """Índice en rejilla de lugares sobre coordenadas proyectadas (equirectangular local, metros).
+
+    Las consultas por radio solo miran las celdas que tocan el círculo y el top-K usa un montículo
+    acotado, así que no hace falta recorrer ni ordenar el DataFrame completo.
+    """
+
+    def __init__(self, lat, lon, cell_m: float = GRID_CELL_M):
+        lat = np.asarray(lat, dtype=float)
+        lon = np.asarray(lon, dtype=float)
+        self.lat, self.lon = lat, lon
+        self.cell_m = float(cell_m)
+        ok = ~(np.isnan(lat) | np.isnan(lon))
+        self.ref_lat = float(np.mean(lat[ok])) if ok.any() else 0.0
+        self._kx = _M_PER_DEG_LAT * math.cos(math.radians(self.ref_lat))
+        x, y = self._project(lat, lon)
+        ids = np.flatnonzero(ok)
+        ci = np.floor(x[ids] / self.cell_m).astype(np.int64)
+        cj = np.floor(y[ids] / self.cell_m).astype(np.int64)
+        self.cells = {}
+        if len(ids):
+            order = np.lexsort((cj, ci))
+            keys = np.column_stack([ci[order], cj[order]])
+            starts = np.flatnonzero(np.r_[True, (np.diff(keys, axis=0) != 0).any(axis=1)])
+            ends = np.r_[starts[1:], len(order)]
+            for s, e in zip(starts, ends):
+                self.cells[(int(keys[s, 0]), int(keys[s, 1]))] = ids[order[s:e]]
+
+    @classmethod
+    def from_df(cls, df: pd.DataFrame, cell_m: float = GRID_CELL_M) -> "PlaceIndex":
+        lat = pd.to_numeric(df["lat"], errors="coerce") if "lat" in df.columns else pd.Series(np.nan, index=df.index)
+        lon = pd.to_numeric(df["lon"], errors="coerce") if "lon" in df.columns else pd.Series(np.nan, index=df.index)
+        return cls(lat.to_numpy(dtype=float), lon.to_numpy(dtype=float), cell_m)
+
+    def __len__(self):
+        return len(self.lat)
+
+    def _project(self, lat, lon):
+        return np.asarray(lon) * self._kx, np.asarray(lat) * _M_PER_DEG_LAT
+
+    def query_radius(self, center_latlon, radius_m: float) -> np.ndarray:
+        """Posiciones (ordenadas) de los lugares a menos de `radius_m` metros del centro."""
+        cx, cy = self._project(center_latlon[0], center_latlon[1])
+        pad = radius_m * 1.01 + 1.0  # margen por la proyección local
+        i0, i1 = int(math.floor((cx - pad) / self.cell_m)), int(math.floor((cx + pad) / self.cell_m))
+        j0, j1 = int(math.floor((cy - pad) / self.cell_m)), int(math.floor((cy + pad) / self.cell_m))
+        hits = [
+            self.cells[(i, j)]
+            for i in range(i0, i1 + 1)
+            for j in range(j0, j1 + 1)
+            if (i, j) in self.cells
+        ]
+        if not hits:
+            return np.empty(0, dtype=np.int64)
+        cand = np.concatenate(hits)
+        dist = haversine_m(center_latlon[0], center_latlon[1], self.lat[cand], self.lon[cand])
+        return np.sort(cand[dist <= radius_m])
+
+    def top_k(self, center_latlon, radius_m: float, k: int, scores) -> np.ndarray:
+        """Posiciones de los `k` lugares con mayor score dentro del radio, de mayor a menor (los NaN
+        al final, empates por posición)."""
+        cand = self.query_radius(center_latlon, radius_m)
+        scores = np.nan_to_num(np.asarray(scores, dtype=float), nan=-np.inf)
+        best = heapq.nlargest(k, cand.tolist(), key=lambda i: (scores[i], -i))
+        return np.asarray(best, dtype=np.int64)
@@ -12,6 +12,11 @@ files["taxonomy.py"] = r'''
 import re
 import random
 import unicodedata
+from functools import lru_cache
+try:
+    from re import _parser as _sre
+except ImportError:  # Python < 3.11
+    import sre_parse as _sre
 
 def _norm(t: str) -> str:
     t = (t or "").lower()
@@ -221,22 +226,178 @@ CANON_BY_EMOTION = {
     ],
 }
 
+# 3) de _map_term_to_canon: adjetivos que se quitan antes de buscar la forma simplificada
+_SIMPLIFY_RE = re.compile(r"\b(tranquil[ao]s?|acogedor[ao]s?|rom[aá]ntic[ao]s?|peque[ñn]o[s]?)\b")
+
+def _expand_pattern(pattern: str) -> list[tuple[str, tuple[int, ...]]]:
+    """Todas las cadenas que casan con un patrón de SYNONYMS_TO_CANON, con las posiciones donde pide
+    `\b`. Solo admite lo que usan esos patrones (literales, clases de literales, grupos, `|` y `?`)."""
+    def seq(items):
+        out = [("", ())]
+        for op, av in items:
+            if op is _sre.LITERAL:
+                alts = [(chr(av), ())]
+            elif op is _sre.IN and all(o is _sre.LITERAL for o, _ in av):
+                alts = [(chr(v), ()) for _, v in av]
+            elif op is _sre.AT and av is _sre.AT_BOUNDARY:
+                alts = [("", (0,))]
+            elif op is _sre.SUBPATTERN:
+                alts = seq(av[-1])
+            elif op is _sre.BRANCH:
+                alts = [x for branch in av[1] for x in seq(branch)]
+            elif op is _sre.MAX_REPEAT and av[:2] == (0, 1):
+                alts = [("", ())] + seq(av[2])
+            else:
+                raise ValueError(f"Patrón de sinónimo no admitido en el índice: {pattern}")
+            out = [(a + b, ia + tuple(len(a) + k for k in ib)) for a, ia in out for b, ib in alts]
+        return out
+    return list(dict.fromkeys(seq(_sre.parse(pattern))))
+
+def _build_automaton(words: list[tuple[str, tuple]]):
+    """Autómata Aho-Corasick sobre `words` (cadena, dato): una pasada por el texto encuentra todas
+    las apariciones, sea cual sea el número de cadenas."""
+    goto, fail, out = [{}], [0], [[]]
+    for word, data in words:
+        s = 0
+        for c in word:
+            if c not in goto[s]:
+                goto[s][c] = len(goto)
+                goto.append({})
+                fail.append(0)
+                out.append([])
+            s = goto[s][c]
+        out[s].append((len(word), data))
+    queue = list(goto[0].values())
+    for s in queue:
+        for c, nxt in goto[s].items():
+            f = fail[s]
+            while f and c not in goto[f]:
+                f = fail[f]
+            fail[nxt] = goto[f][c] if s and c in goto[f] else 0
+            out[nxt] = out[nxt] + out[fail[nxt]]
+            queue.append(nxt)
+    return goto, fail, out
+
+def _is_word(t: str, i: int) -> bool:
+    return 0 <= i < len(t) and (t[i].isalnum() or t[i] == "_")
+
+def _build_canon_index():
+    """Índice de normalización construido una vez: un autómata con las expansiones de todos los
+    sinónimos y el canon normalizado (para `canon in t`), las subcadenas de cada canon (para
+    `t in canon`) y la forma exacta (para la heurística)."""
+    canon_norm = [_norm(c) for c in CANON_KEYWORDS]
+    words = []
+    for i, pat in enumerate(SYNONYMS_TO_CANON):
+        words += [(w, ("syn", i, bounds)) for w, bounds in _expand_pattern(pat)]
+    words += [(c, ("canon", i, ())) for i, c in enumerate(canon_norm)]
+    substrings = {}
+    for i, c in enumerate(canon_norm):
+        for a in range(len(c) + 1):
+            for b in range(a, len(c) + 1):
+                substrings.setdefault(c[a:b], i)
+    exact = {}
+    for i, c in enumerate(canon_norm):
+        exact.setdefault(c, i)
+    return {
+        "automaton": _build_automaton(words),
+        "syn_canon": list(SYNONYMS_TO_CANON.values()),
+        "canon_substrings": substrings,
+        "canon_exact": exact,
+    }
+
+_CANON_INDEX = _build_canon_index()
+
+def _scan(t: str) -> tuple[int | None, int | None]:
+    """(primer sinónimo, primer canon contenido en t) según el orden de sus listas, en una pasada."""
+    goto, fail, out = _CANON_INDEX["automaton"]
+    best = {"syn": None, "canon": None}
+    s = 0
+    for end, c in enumerate(t, 1):
+        while s and c not in goto[s]:
+            s = fail[s]
+        s = goto[s].get(c, 0)
+        for n, (kind, i, bounds) in out[s]:
+            if best[kind] is not None and best[kind] <= i:
+                continue
+            start = end - n
+            if all(_is_word(t, start + k - 1) != _is_word(t, start + k) for k in bounds):
+                best[kind] = i
+    return best["syn"], best["canon"]
+
+@lru_cache(maxsize=4096)
+def _canon_lookup(t: str) -> str | None:
+    """Pasos 1-3 de _map_term_to_canon sobre un término ya normalizado; None si toca el fallback.
+    Memoizado: en lotes y entre clics los mismos términos se repiten mucho."""
+    idx = _CANON_INDEX
+    syn, canon_in = _scan(t)
+    # 1) Sinónimos por regex (gana el primero del diccionario)
+    if syn is not None:
+        return idx["syn_canon"][syn]
+    # 2) Coincidencia directa con canon: el primero que contiene a t o está contenido en t
+    hits = [j for j in (idx["canon_substrings"].get(t), canon_in) if j is not None]
+    if hits:
+        return CANON_KEYWORDS[min(hits)]
+    # 3) Heurística
+    i = idx["canon_exact"].get(_SIMPLIFY_RE.sub("", t).strip())
+    return CANON_KEYWORDS[i] if i is not None else None
+
 def _map_term_to_canon(term: str, category_hint: str = "neutro") -> str:
     """Mapea un término a una keyword canónica Nearby-friendly."""
-    t = _norm(term)
-    # 1) Sinónimos por regex
+    canon = _canon_lookup(_norm(term))
+    if canon is not None:
+        return canon
+    # 4) Fallback por emoción
+    pool = CANON_BY_EMOTION.get(category_hint, CANON_BY_EMOTION["neutro"])
+    return random.choice(pool)
+
+def map_terms_to_canon(terms: list[str], category_hint: str = "neutro") -> list[str]:
+    """_map_term_to_canon para una lista (los repetidos se resuelven una vez)."""
+    seen = {}
+    out = []
+    for term in terms:
+        if term not in seen:
+            seen[term] = _map_term_to_canon(term, category_hint)
+        out.append(seen[term])
+    return out
+
+def _canon_lookup_reference(t: str) -> str | None:
+    """Implementación original (pasos 1-3), para comparar con el índice."""
     for pat, canon in SYNONYMS_TO_CANON.items():
         if re.search(pat, t):
             return canon
-    # 2) Coincidencia directa con canon
     for canon in CANON_KEYWORDS:
         if _norm(canon) in t or t in _norm(canon):
             return canon
-    # 3) Heurística
     t_simple = re.sub(r"\b(tranquil[ao]s?|acogedor[ao]s?|rom[aá]ntic[ao]s?|peque[ñn]o[s]?)\b", "", t).strip()
     for canon in CANON_KEYWORDS:
         if _norm(canon) == t_simple:
             return canon
-    # 4) Fallback por emoción
-    pool = CANON_BY_EMOTION.get(category_hint, CANON_BY_EMOTION["neutro"])
-    return random.choice(pool)
\ No newline at end of file
+    return None
+
+def benchmark_canon_index(repeat: int = 200) -> dict:
+    """Compara índice y bucle original sobre el vocabulario curado: resultados idénticos y tiempos."""
+    import time
+    vocab = list(dict.fromkeys(
+        [t for terms in CURATED_BY_CATEGORY.values() for t in terms]
+        + [t for terms in CANON_BY_EMOTION.values() for t in terms]
+        + CANON_KEYWORDS
+    ))
+    normed = [_norm(t) for t in vocab]
+    lookup = _canon_lookup.__wrapped__  # sin la memoización, para medir el índice
+    mismatches = [v for v, t in zip(vocab, normed) if lookup(t) != _canon_lookup_reference(t)]
+    t0 = time.perf_counter()
+    for _ in range(repeat):
+        for t in normed:
+            _canon_lookup_reference(t)
+    t1 = time.perf_counter()
+    for _ in range(repeat):
+        for t in normed:
+            lookup(t)
+    t2 = time.perf_counter()
+    return {
+        "terms": len(vocab),
+        "identical": not mismatches,
+        "mismatches": mismatches,
+        "reference_us": (t1 - t0) / (repeat * len(vocab)) * 1e6,
+        "index_us": (t2 - t1) / (repeat * len(vocab)) * 1e6,
+    }